@@ -1,4 +1,7 @@
-from typing import Dict, Any
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Tuple
 from .ToolAgent_V3 import ToolAgent, mcp, tool_call
 from ..tool.EpubToMDConverter_V6 import EpubToMDConverter, ConversionType
 
@@ -9,6 +12,18 @@ from ..tool.EpubToMDConverter_V6 import EpubToMDConverter, ConversionType
     features=["epub转markdown", "支持多种输出格式", "自动提取图片", "支持多文件/单文件/内嵌图片"]
 )
 class Epub2MarkDownAgent(ToolAgent):
+    # 每个缓存的转换器配一把锁：共享同一转换器的调用串行执行，不同书籍的转换互不阻塞
+    # 转换器会把整本书的图片和文档留在内存中，只缓存最近使用的少数几本
+    @staticmethod
+    @lru_cache(maxsize=2)
+    def _cached_converter(epub_path: str, mtime: float) -> Tuple[EpubToMDConverter, threading.Lock]:
+        return EpubToMDConverter(epub_path), threading.Lock()
+
+    @classmethod
+    def _get_converter(cls, epub_path: str) -> Tuple[EpubToMDConverter, threading.Lock]:
+        """同一 epub 文件复用已加载的转换器及其锁，文件修改时间变化后自动失效"""
+        return cls._cached_converter(epub_path, os.path.getmtime(epub_path))
+
     @tool_call(
         description="将epub文件转换为markdown文档，支持多种输出模式",
         input_context={
@@ -23,7 +38,7 @@ class Epub2MarkDownAgent(ToolAgent):
     )
     def run(self, epub_path: str, output_path: str, conversion_type: str = "single_file") -> Dict[str, Any]:
         try:
-            converter = EpubToMDConverter(epub_path)
+            converter, convert_lock = self._get_converter(epub_path)
             # 转换类型映射
             type_map = {
                 "multiple_files": ConversionType.MULTIPLE_FILES,
@@ -31,7 +46,8 @@ class Epub2MarkDownAgent(ToolAgent):
                 "single_file_with_base64": ConversionType.SINGLE_FILE_WITH_BASE64
             }
             conv_type = type_map.get(conversion_type, ConversionType.SINGLE_FILE)
-            converter.convert(conv_type, output_path)
+            with convert_lock:
+                converter.convert(conv_type, output_path)
             return {
                 "success": True,
                 "message": f"转换成功，输出路径：{output_path}"
@@ -6,6 +6,8 @@ import asyncio
 import json
 import inspect
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 def agent_operation(func,description="",is_mcp_tool=True):
     func.is_mcp_tool = is_mcp_tool
@@ -18,6 +20,9 @@ class StrategyExecAgent(ABC):
     支持：describe、invoke、invoke_async、结构化返回与错误处理。
     """
 
+    # _arun 默认包装同步逻辑时，专用线程池的最大线程数
+    max_workers: int = 4
+
     # ---------- MCP接口：工具元信息 ----------
     @abstractmethod
     def name(self) -> str:
@@ -46,9 +51,23 @@ class StrategyExecAgent(ABC):
         pass
 
     async def _arun(self, inputs: Dict[str, Any]) -> Union[str, Dict[str, Any]]:
-        """异步逻辑：默认包装同步逻辑，可被子类覆盖"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._run, inputs)
+        """异步逻辑：默认在专用线程池中运行同步逻辑，可被子类覆盖"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, inputs)
+
+    @cached_property
+    def _executor(self) -> ThreadPoolExecutor:
+        """Agent 专用线程池，避免与默认执行器上的其他任务相互争抢"""
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name())
+
+    def close(self) -> None:
+        """关闭专用线程池，不等待在途任务；之后再调用 _arun 会重新创建线程池"""
+        executor = self.__dict__.pop('_executor', None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __del__(self):
+        self.close()
 
     # ---------- MCP标准接口：描述 ----------
     def describe(self) -> Dict[str, Any]:
@@ -66,7 +85,7 @@ class StrategyExecAgent(ABC):
         }
 
     def supports_async(self) -> bool:
-        return self._arun.__func__ != StrategyExecAgent._arun
+        return type(self)._arun is not StrategyExecAgent._arun
 
     # ---------- 调用统一入口 ----------
     def invoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
@@ -75,10 +94,25 @@ class StrategyExecAgent(ABC):
     async def invoke_async(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
         return await self._safe_invoke_async(self._arun, inputs)
 
+    # ---------- 输入校验 ----------
+    @cached_property
+    def _validator(self):
+        """按 input_schema 预编译的校验器，每个实例只构建一次"""
+        schema = self.input_schema()
+        validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+        return validator_cls(schema)
+
+    def _validate(self, inputs: Dict[str, Any]) -> None:
+        """与 jsonschema.validate 一致：抛出最相关的一条校验错误"""
+        error = jsonschema.exceptions.best_match(self._validator.iter_errors(inputs))
+        if error is not None:
+            raise error
+
     # ---------- 安全执行（统一结构 + 错误处理） ----------
     def _safe_invoke(self, func, inputs) -> Dict[str, Any]:
         try:
-            jsonschema.validate(instance=inputs, schema=self.input_schema())
+            self._validate(inputs)
             result = func(inputs)
             return self._format_success(result)
         except Exception as e:
@@ -86,7 +120,7 @@ class StrategyExecAgent(ABC):
 
     async def _safe_invoke_async(self, func, inputs) -> Dict[str, Any]:
         try:
-            jsonschema.validate(instance=inputs, schema=self.input_schema())
+            self._validate(inputs)
             result = await func(inputs)
             return self._format_success(result)
         except Exception as e:
@@ -1,11 +1,20 @@
 import json
-import time
+import asyncio
 import os
+import random
+import time
+import queue
+import threading
 import argparse
 from http import HTTPStatus
 from dotenv import load_dotenv
 from dashscope import Application
 
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 解析/序列化
+except ImportError:
+    orjson = None
+
 # 加载 .env 文件
 load_dotenv()
 
@@ -16,70 +25,225 @@ APP_ID = os.getenv("BAILIAN_APP_ID")
 assert API_KEY, "请在 .env 文件中设置 BAILIAN_API_KEY"
 assert APP_ID, "请在 .env 文件中设置 BAILIAN_APP_ID"
 
-# Prompt 构建模板
-def build_prompt(entry):
-    base_prompt = f"""你是一个金融结构化分析Agent，当前任务是从段落中抽取K线图形态或技术指标的结构化信息。
+# 并发请求数上限
+CONCURRENCY = 8
+
+# 每秒请求数上限（令牌桶限速）
+RATE_PER_SEC = 10
+
+# 失败重试：最多尝试次数与指数退避参数（秒）
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+RETRYABLE_STATUS = {
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+}
+
+# JSONL 读写：优先使用 orjson，未安装时回退到标准库 json
+def loads_line(line):
+    return orjson.loads(line) if orjson else json.loads(line)
+
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+# Prompt 模板：固定前缀只构建一次，段落文本直接拼接在末尾
+PROMPT_PREFIX = """你是一个金融结构化分析Agent，当前任务是从段落中抽取K线图形态或技术指标的结构化信息。
 请按如下格式输出JSON：
-{{
+{
   "indicator_name": "...",
   "definition": "...",
   "signal_logic": "...",
   "figure_ref": "...",
   "qa_pairs": [
-    {{
+    {
       "Q": "...",
       "A": "..."
-    }}
+    }
   ]
-}}
+}
 
 请分析下列段落：
-{entry.get('text_full') or entry.get('text')}
 """
-    return base_prompt
 
-# 主逻辑函数
-def main(input_file, output_file, max_count=None):
-    with open(input_file, "r", encoding="utf-8") as infile, \
-         open(output_file, "w", encoding="utf-8") as outfile:
+# Prompt 构建：调用方传入已解析的段落文本
+def build_prompt(text):
+    return PROMPT_PREFIX + text + "\n"
 
-        for idx, line in enumerate(infile):
-            if max_count is not None and idx >= max_count:
-                print(f"🚫 已达到最大处理数量 {max_count}，提前结束。")
-                break
+# 令牌桶限速：按每秒速率补充令牌，请求前取走一个令牌，桶容量即允许的瞬时突发数
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
 
-            try:
-                entry = json.loads(line.strip())
-                prompt = build_prompt(entry)
+    async def __aenter__(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return self
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
-                print(f"📨 正在处理第 {idx + 1} 段：{entry['text'][:50]}...")
+    async def __aexit__(self, *exc_info):
+        return False
 
-                response = Application.call(
+# 调用百炼应用：网络异常、限流或服务端错误时按指数退避（带抖动）重试，等待期间不阻塞其他请求
+async def call_application(prompt, limiter):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            async with limiter:
+                response = await asyncio.to_thread(
+                    Application.call,
                     api_key=API_KEY,
                     app_id=APP_ID,
                     prompt=prompt
                 )
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            reason = e
+        else:
+            if response.status_code not in RETRYABLE_STATUS or attempt == MAX_ATTEMPTS:
+                return response
+            reason = f"{response.status_code} - {response.message}"
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, BACKOFF_BASE)
+        print(f"🔁 第 {attempt} 次请求失败（{reason}），{delay:.1f} 秒后重试")
+        await asyncio.sleep(delay)
 
-                result = {
-                    "input": entry.get("text_full") or entry.get("text"),
-                    "output": response.output.text if response.status_code == HTTPStatus.OK else "ERROR",
-                    "error": None if response.status_code == HTTPStatus.OK else {
-                        "code": response.status_code,
-                        "message": response.message,
-                        "request_id": response.request_id
-                    }
+# 单段处理：在信号量限制的并发槽位内调用百炼应用
+async def process(idx, line, sem, limiter):
+    async with sem:
+        try:
+            entry = loads_line(line)
+            text = entry.get("text_full") or entry.get("text")
+            prompt = build_prompt(text)
+
+            print(f"📨 正在处理第 {idx + 1} 段：{entry['text'][:50]}...")
+
+            response = await call_application(prompt, limiter)
+
+            result = {
+                "input": text,
+                "output": response.output.text if response.status_code == HTTPStatus.OK else "ERROR",
+                "error": None if response.status_code == HTTPStatus.OK else {
+                    "code": response.status_code,
+                    "message": response.message,
+                    "request_id": response.request_id
                 }
+            }
+
+            if response.status_code == HTTPStatus.OK:
+                print(f"✅ 第 {idx + 1} 段成功")
+            else:
+                print(f"❌ 第 {idx + 1} 段错误: {response.status_code} - {response.message}")
+
+            return result
+
+        except Exception as e:
+            print(f"⚠️ 处理第 {idx + 1} 段失败：{e}")
+            return None
+
+# 后台写入线程：生产方投递已序列化的行，线程按批次落盘，文件 I/O 不占用事件循环
+# 队列不设上限，put 在事件循环中调用时永不阻塞；写入线程出错时记录异常，由 put/close 重新抛出
+class JsonlWriter(threading.Thread):
+    _SENTINEL = object()
+
+    def __init__(self, outfile, batch_size=64, flush_interval=0.2):
+        super().__init__(name="jsonl-writer", daemon=True)
+        self.outfile = outfile
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lines = queue.Queue()
+        self.error = None
+
+    def put(self, data):
+        if self.error:
+            raise self.error
+        self.lines.put(data)
+
+    def close(self):
+        self.lines.put(self._SENTINEL)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        try:
+            self._write_batches()
+        except BaseException as e:
+            self.error = e
+
+    def _write_batches(self):
+        while True:
+            item = self.lines.get()
+            batch = []
+            while item is not self._SENTINEL:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.lines.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+            if batch:
+                self.outfile.writelines(batch)
+                self.outfile.flush()
+            if item is self._SENTINEL:
+                return
+
+# 单一收集任务：按输入顺序交给写入线程，失败的段落以 None 占位并跳过
+async def write_results(result_queue, writer):
+    pending = {}
+    next_idx = 0
+    while True:
+        item = await result_queue.get()
+        if item is None:
+            break
+        idx, result = item
+        pending[idx] = result
+        while next_idx in pending:
+            result = pending.pop(next_idx)
+            if result is not None:
+                writer.put(dumps_line(result))
+            next_idx += 1
+
+# 主逻辑函数
+async def main(input_file, output_file, max_count=None, concurrency=CONCURRENCY, rate=RATE_PER_SEC):
+    with open(input_file, "rb") as infile, \
+         open(output_file, "wb") as outfile:
+
+        lines = []
+        for idx, line in enumerate(infile):
+            if max_count is not None and idx >= max_count:
+                print(f"🚫 已达到最大处理数量 {max_count}，提前结束。")
+                break
+            lines.append(line)
 
-                if response.status_code == HTTPStatus.OK:
-                    print("✅ 成功")
-                else:
-                    print(f"❌ 错误: {response.status_code} - {response.message}")
+        sem = asyncio.Semaphore(concurrency)
+        limiter = RateLimiter(rate)
+        result_queue = asyncio.Queue()
+        writer = JsonlWriter(outfile)
+        writer.start()
+        collector = asyncio.create_task(write_results(result_queue, writer))
 
-                outfile.write(json.dumps(result, ensure_ascii=False) + "\n")
-                time.sleep(1)
+        async def run(idx, line):
+            await result_queue.put((idx, await process(idx, line, sem, limiter)))
 
-            except Exception as e:
-                print(f"⚠️ 处理第 {idx + 1} 段失败：{e}")
+        await asyncio.gather(*(run(idx, line) for idx, line in enumerate(lines)))
+        await result_queue.put(None)
+        await collector
+        writer.close()
 
 # 启动入口，支持命令行参数
 if __name__ == "__main__":
@@ -87,6 +251,8 @@ if __name__ == "__main__":
     parser.add_argument("--input-file", type=str, default="data/term_et_action_input_data.jsonl", help="输入文件路径")
     parser.add_argument("--output-file", type=str, default="data/term_et_action_output_data.jsonl", help="输出文件路径")
     parser.add_argument("--max-count", type=int, default=None, help="最大处理条数，默认不限制")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="并发请求数，默认 8")
+    parser.add_argument("--rate", type=float, default=RATE_PER_SEC, help="每秒请求数上限，默认 10")
 
     args = parser.parse_args()
-    main(input_file=args.input_file, output_file=args.output_file, max_count=args.max_count)
\ No newline at end of file
+    asyncio.run(main(input_file=args.input_file, output_file=args.output_file, max_count=args.max_count, concurrency=args.concurrency, rate=args.rate))
\ No newline at end of file
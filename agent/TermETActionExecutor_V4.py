@@ -1,11 +1,22 @@
 import json
-import time
+import re
+import asyncio
 import os
+import random
+import time
+import queue
+import threading
 import argparse
+from itertools import islice
 from http import HTTPStatus
 from dotenv import load_dotenv
 from dashscope import Application
 
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 解析/序列化
+except ImportError:
+    orjson = None
+
 # 加载 .env 文件
 load_dotenv()
 
@@ -16,12 +27,50 @@ APP_ID = os.getenv("BAILIAN_APP_ID")
 assert API_KEY, "请在 .env 文件中设置 BAILIAN_API_KEY"
 assert APP_ID, "请在 .env 文件中设置 BAILIAN_APP_ID"
 
+# 并发请求数上限
+CONCURRENCY = 8
+
+# 每秒请求数上限（令牌桶限速）
+RATE_PER_SEC = 10
+
+# 失败重试：最多尝试次数与指数退避参数（秒）
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+RETRYABLE_STATUS = {
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+}
+
 INPUT_FILE = "data/金融市场技术分析_term_et_action_input_v7.jsonl"
 OUTPUT_FILE = "data/金融市场技术分析_term_et_action_output_v9.jsonl"
 
 
-# Prompt 构建模板
-def build_prompt(entry):
+# JSONL 读写：优先使用 orjson，未安装时回退到标准库 json
+def loads_line(line):
+    return orjson.loads(line) if orjson else json.loads(line)
+
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+# 每次请求打包的段落数
+BATCH_SIZE = 5
+
+# 去除模型输出外层的 ```json 代码块标记
+FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+# Prompt 构建模板：多个段落编号后打包进同一个请求，调用方传入已解析的段落文本
+def build_prompt(texts):
+    items = "\n".join(
+        f"<<ITEM {i}>>{text}<</ITEM {i}>>"
+        for i, text in enumerate(texts, 1)
+    )
     base_prompt = f"""你是一个“股票术语分析助手”，专门负责从金融技术分析类书籍中提取【技术术语卡片】。
 你的目标是提取与K线图形态、技术指标、交易信号或分析方法相关的术语及其定义和使用逻辑，并为用户构建结构化知识卡片，便于索引、检索与问答。
 
@@ -32,71 +81,267 @@ def build_prompt(entry):
 2. 如果包含术语信息，按以下格式输出完整结构卡片；
 3. 如果是导言、图书目录或无术语的段落，仅生成 `qa_pairs` 字段，其他字段留空；
 4. 若信息不足，可合理补全术语逻辑，保持真实但不虚构；
-5. 严格输出为可解析 JSON 字符串，格式见下方。
+5. 严格输出为可解析 JSON 字符串，格式见下方；
+6. 下方共有 {len(texts)} 个以 <<ITEM i>> 标记的段落，请逐段分析，输出一个长度为 {len(texts)} 的 JSON 数组，第 i 个元素对应第 i 个段落，顺序保持一致。
 
 【输出格式】
 ```json
-{{
-  "indicator_name": "术语名称（如：头肩顶、RSI、趋势线等）",
-  "definition": "简洁定义，说明它是什么",
-  "signal_logic": "它在交易中的使用逻辑或触发条件",
-  "figure_ref": "图号或图示引用（如有）",
-  "qa_pairs": [
-    {{ "Q": "问题1", "A": "答案1" }},
-    {{ "Q": "问题2", "A": "答案2" }}
-  ]
-}}
+[
+  {{
+    "indicator_name": "术语名称（如：头肩顶、RSI、趋势线等）",
+    "definition": "简洁定义，说明它是什么",
+    "signal_logic": "它在交易中的使用逻辑或触发条件",
+    "figure_ref": "图号或图示引用（如有）",
+    "qa_pairs": [
+      {{ "Q": "问题1", "A": "答案1" }},
+      {{ "Q": "问题2", "A": "答案2" }}
+    ]
+  }}
+]
 
 请分析下列段落：
-{entry.get('text_full') or entry.get('text')}
+{items}
 """
     return base_prompt
 
-# 主逻辑
-def main(max_count=None):
-    with open(INPUT_FILE, "r", encoding="utf-8") as infile, \
-         open(OUTPUT_FILE, "w", encoding="utf-8") as outfile:
+# 解析批量输出，要求返回与输入等长的卡片数组
+def parse_batch_output(text, expected):
+    match = FENCE_PATTERN.match(text)
+    cards = json.loads(match.group(1) if match else text)
+    if not isinstance(cards, list) or len(cards) != expected:
+        raise ValueError(f"期望 {expected} 张卡片，实际返回：{type(cards).__name__}")
+    return cards
 
-        for idx, line in enumerate(infile):
-            if max_count is not None and idx >= max_count:
-                print(f"🚫 已达到最大处理数量 {max_count}，提前结束。")
-                break
+# 单张卡片按单段请求时的输出格式保存，保持与报告生成脚本兼容
+def render_output(card):
+    return "```json\n" + json.dumps(card, ensure_ascii=False, indent=2) + "\n```"
 
-            try:
-                entry = json.loads(line.strip())
-                prompt = build_prompt(entry)
+# 令牌桶限速：按每秒速率补充令牌，请求前取走一个令牌，桶容量即允许的瞬时突发数
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return self
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
-                print(f"📨 正在处理第 {idx + 1} 段：{entry['text'][:50]}...")
+    async def __aexit__(self, *exc_info):
+        return False
 
-                response = Application.call(
+# 调用百炼应用：网络异常、限流或服务端错误时按指数退避（带抖动）重试，等待期间不阻塞其他请求
+async def call_application(prompt, limiter):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            async with limiter:
+                response = await asyncio.to_thread(
+                    Application.call,
                     api_key=API_KEY,
                     app_id=APP_ID,
                     prompt=prompt
                 )
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            reason = e
+        else:
+            if response.status_code not in RETRYABLE_STATUS or attempt == MAX_ATTEMPTS:
+                return response
+            reason = f"{response.status_code} - {response.message}"
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, BACKOFF_BASE)
+        print(f"🔁 第 {attempt} 次请求失败（{reason}），{delay:.1f} 秒后重试")
+        await asyncio.sleep(delay)
+
+# 批量调用：JSON 解析失败时对半拆分重试，避免单个坏响应拖垮整批
+async def call_batch(texts, limiter, prompt=None):
+    prompt = prompt or build_prompt(texts)
+    response = await call_application(prompt, limiter)
+
+    if response.status_code != HTTPStatus.OK:
+        error = {
+            "code": response.status_code,
+            "message": response.message,
+            "request_id": response.request_id
+        }
+        return [
+            {"input": text, "output": "ERROR", "error": error}
+            for text in texts
+        ]
+
+    try:
+        cards = parse_batch_output(response.output.text, len(texts))
+    except (ValueError, TypeError) as e:  # output.text 为 None 时按解析失败处理
+        if len(texts) == 1:
+            return [{"input": texts[0], "output": response.output.text, "error": None}]
+        half = len(texts) // 2
+        print(f"⚠️ 批量结果解析失败（{e}），拆分为 {half} + {len(texts) - half} 段重试")
+        return await call_batch(texts[:half], limiter) + await call_batch(texts[half:], limiter)
+
+    return [
+        {"input": text, "output": render_output(card), "error": None}
+        for text, card in zip(texts, cards)
+    ]
 
-                result = {
-                    "input": entry.get("text_full") or entry.get("text"),
-                    "output": response.output.text if response.status_code == HTTPStatus.OK else "ERROR",
-                    "error": None if response.status_code == HTTPStatus.OK else {
-                        "code": response.status_code,
-                        "message": response.message,
-                        "request_id": response.request_id
-                    }
-                }
+# 单批处理：由消费任务调用，输入已在预读阶段解析并构建好 Prompt
+async def process(idx, texts, prompt, limiter):
+    try:
+        print(f"📨 正在处理第 {idx + 1} 批（{len(texts)} 段）：{texts[0][:50]}...")
 
-                if response.status_code == HTTPStatus.OK:
-                    print("✅ 成功")
-                else:
-                    print(f"❌ 错误: {response.status_code} - {response.message}")
+        results = await call_batch(texts, limiter, prompt)
 
-                outfile.write(json.dumps(result, ensure_ascii=False) + "\n")
-                time.sleep(1)  # 控制请求频率
+        errors = [result["error"] for result in results if result["error"]]
+        if errors:
+            print(f"❌ 第 {idx + 1} 批有 {len(errors)} 段错误: {errors[0]['code']} - {errors[0]['message']}")
+        else:
+            print(f"✅ 第 {idx + 1} 批成功")
 
+        return results
+
+    except Exception as e:
+        print(f"⚠️ 处理第 {idx + 1} 批失败：{e}")
+        return None
+
+# 解析单行输入，返回段落文本
+def parse_text(line):
+    entry = loads_line(line)
+    text = entry.get("text_full") or entry.get("text")
+    if not isinstance(text, str):
+        raise ValueError("缺少 text 字段")
+    return text
+
+# 预读生产者：逐批读取、解析并构建 Prompt，放入容量为 2 的队列，磁盘读取与在途请求重叠
+# 每行单独解析，格式错误的行只跳过该行，同批其余段落照常处理
+async def produce_batches(lines, batch_size, batch_queue, result_queue, workers):
+    count = 0
+    idx = 0
+    while chunk := list(islice(lines, batch_size)):
+        texts = []
+        for line in chunk:
+            count += 1
+            try:
+                texts.append(parse_text(line))
             except Exception as e:
-                print(f"⚠️ 处理第 {idx + 1} 段失败：{e}")
+                print(f"⚠️ 处理第 {count} 段失败：{e}")
+        if texts:
+            await batch_queue.put((idx, texts, build_prompt(texts)))
+        else:
+            await result_queue.put((idx, None))
+        idx += 1
+    for _ in range(workers):
+        await batch_queue.put(None)
+    return count
+
+# 消费任务：取出预读好的批次发起请求，结果交给收集任务
+async def consume_batches(batch_queue, result_queue, limiter):
+    while (item := await batch_queue.get()) is not None:
+        idx, texts, prompt = item
+        await result_queue.put((idx, await process(idx, texts, prompt, limiter)))
+
+# 后台写入线程：生产方投递已序列化的行，线程按批次落盘，文件 I/O 不占用事件循环
+# 队列不设上限，put 在事件循环中调用时永不阻塞；写入线程出错时记录异常，由 put/close 重新抛出
+class JsonlWriter(threading.Thread):
+    _SENTINEL = object()
+
+    def __init__(self, outfile, batch_size=64, flush_interval=0.2):
+        super().__init__(name="jsonl-writer", daemon=True)
+        self.outfile = outfile
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lines = queue.Queue()
+        self.error = None
+
+    def put(self, data):
+        if self.error:
+            raise self.error
+        self.lines.put(data)
+
+    def close(self):
+        self.lines.put(self._SENTINEL)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        try:
+            self._write_batches()
+        except BaseException as e:
+            self.error = e
+
+    def _write_batches(self):
+        while True:
+            item = self.lines.get()
+            batch = []
+            while item is not self._SENTINEL:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.lines.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+            if batch:
+                self.outfile.writelines(batch)
+                self.outfile.flush()
+            if item is self._SENTINEL:
+                return
+
+# 单一收集任务：按输入顺序交给写入线程，失败的批次以 None 占位并跳过
+async def write_results(result_queue, writer):
+    pending = {}
+    next_idx = 0
+    while True:
+        item = await result_queue.get()
+        if item is None:
+            break
+        idx, results = item
+        pending[idx] = results
+        while next_idx in pending:
+            results = pending.pop(next_idx)
+            for result in results or []:
+                writer.put(dumps_line(result))
+            next_idx += 1
+
+# 主逻辑
+async def main(max_count=None, concurrency=CONCURRENCY, batch_size=BATCH_SIZE, rate=RATE_PER_SEC):
+    with open(INPUT_FILE, "rb") as infile, \
+         open(OUTPUT_FILE, "wb") as outfile:
+
+        limiter = RateLimiter(rate)
+        batch_queue = asyncio.Queue(maxsize=2)
+        result_queue = asyncio.Queue()
+        writer = JsonlWriter(outfile)
+        writer.start()
+        collector = asyncio.create_task(write_results(result_queue, writer))
+        consumers = [
+            asyncio.create_task(consume_batches(batch_queue, result_queue, limiter))
+            for _ in range(concurrency)
+        ]
+
+        lines = islice(infile, max_count)
+        count = await produce_batches(lines, batch_size, batch_queue, result_queue, concurrency)
+        await asyncio.gather(*consumers)
+        if max_count is not None and count >= max_count:
+            print(f"🚫 已达到最大处理数量 {max_count}，提前结束。")
+
+        await result_queue.put(None)
+        await collector
+        writer.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="结构化技术分析段落")
     parser.add_argument("--max-count", type=int, default=None, help="最大处理条数，默认不限制")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="并发请求数，默认 8")
+    parser.add_argument("--rate", type=float, default=RATE_PER_SEC, help="每秒请求数上限，默认 10")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每次请求打包的段落数，默认 5")
     args = parser.parse_args()
-    main(max_count=args.max_count)
+    asyncio.run(main(max_count=args.max_count, concurrency=args.concurrency, rate=args.rate, batch_size=args.batch_size))
\ No newline at end of file
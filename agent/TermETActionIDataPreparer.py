@@ -1,6 +1,11 @@
-import fitz  # PyMuPDF
 import re
 import json
+from collections import deque
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 序列化
+except ImportError:
+    orjson = None
 
 # ====== 路径配置 ======
 pdf_path = "file/日本蜡烛图技术.pdf"
@@ -15,30 +20,40 @@ keywords = [
     "顶部", "底部", "趋势", "上涨", "下跌"
 ]
 
-# ====== 标题提取逻辑 ======
+# ====== 预编译正则 ======
+KEYWORDS_RE = re.compile("|".join(map(re.escape, keywords)))
+BLACKLIST_RE = re.compile(r"免责声明|版权所有|微信|扫码|www\.|http|\.cn|大学|出版社")
+CHAPTER_TITLE_RE = re.compile(r"^(第[一二三四五六七八九十百]+章)(\s|$)")
+SECTION_KEYWORDS_RE = re.compile(r"形态|模型|K线|线图|指标")
+FIGURE_RE = re.compile(r"(图\d+(\.\d+)?)")
+DEFINITION_RE = re.compile(r".*?[是为指称叫属于构成]+.*?一种.*?[形态模型结构]?")
+ACTION_RE = re.compile(r"买入|卖出|信号|建议|触发|策略")
+TERM_RE = re.compile(r"形态|模型|K线|指标")
+
+# ====== 标题提取逻辑（调用方传入已 strip 的文本） ======
 def extract_chapter_title(text):
-    match = re.match(r"^(第[一二三四五六七八九十百]+章)(\s|$)", text.strip())
+    match = CHAPTER_TITLE_RE.match(text)
     return match.group(1) if match else None
 
 def extract_section_title(text):
-    if len(text.strip()) <= 25 and any(kw in text for kw in ["形态", "模型", "K线", "线图", "指标"]):
-        return text.strip()
+    if len(text) <= 25 and SECTION_KEYWORDS_RE.search(text):
+        return text
     return None
 
 # ====== 图号提取 ======
 def extract_figure(text):
-    match = re.search(r"(图\d+(\.\d+)?)", text)
+    match = FIGURE_RE.search(text)
     return match.group(1) if match else None
 
 # ====== 类型识别逻辑 ======
 def classify_type(text):
-    if re.match(r".*?[是为指称叫属于构成]+.*?一种.*?[形态模型结构]?", text):
+    if DEFINITION_RE.match(text):
         return "定义"
-    elif any(x in text for x in ["买入", "卖出", "信号", "建议", "触发", "策略"]):
+    elif ACTION_RE.search(text):
         return "交易逻辑"
     elif extract_figure(text):
         return "图注"
-    elif len(text) <= 40 and any(kw in text for kw in ["形态", "模型", "K线", "指标"]):
+    elif len(text) <= 40 and TERM_RE.search(text):
         return "术语"
     else:
         return "说明"
@@ -47,88 +62,106 @@ def classify_type(text):
 def is_valid(text):
     if not (25 <= len(text) <= 350):
         return False
-    if not any(kw in text for kw in keywords):
+    if BLACKLIST_RE.search(text):
         return False
-    if re.search(r"(免责声明|版权所有|微信|扫码|www\.|http|\.cn|大学|出版社)", text):
+    if not KEYWORDS_RE.search(text):
         return False
     if text.endswith("：") or len(text.split()) < 3:
         return False
     return True
 
-# ====== 主提取逻辑 ======
-doc = fitz.open(pdf_path)
-results = []
-buffer = []
-current_chapter = None
-current_section = None
-
-for page in doc:
-    page_number = page.number + 1
-    blocks = page.get_text("blocks")
-    for block in blocks:
-        for line in block[4].split("\n"):
-            text = line.strip()
-            if not text:
-                continue
-
-            # 检测章节、小节
-            chapter_title = extract_chapter_title(text)
-            if chapter_title:
-                current_chapter = chapter_title
-                continue
-
-            section_title = extract_section_title(text)
-            if section_title:
-                current_section = section_title
-                continue
-
-            # 检测合法段落
-            if not is_valid(text):
-                continue
-
-            fig_id = extract_figure(text)
-            ptype = classify_type(text)
-
-            # 图段进入缓冲
-            if ptype == "图注":
-                buffer.append({
-                    "text": text,
-                    "page": page_number,
-                    "chapter": current_chapter,
-                    "section_title": current_section,
-                    "figure": fig_id,
-                    "type": ptype,
-                    "source": "日本蜡烛图技术"
-                })
-                continue
-
-            # 补全图注（合并下段）
-            if buffer:
-                fig_entry = buffer.pop()
-                fig_entry["text_full"] = fig_entry["text"] + " " + text
-                fig_entry["from_figure_merge"] = True
-                fig_entry["context_window"] = []
-                fig_entry["page"] = page_number
-                fig_entry["chapter"] = current_chapter
-                fig_entry["section_title"] = current_section
-                fig_entry["source"] = "日本蜡烛图技术"
-                results.append(fig_entry)
-            else:
-                entry = {
-                    "text": text,
-                    "page": page_number,
-                    "chapter": current_chapter,
-                    "section_title": current_section,
-                    "figure": fig_id,
-                    "type": ptype,
-                    "context_window": [r["text"] for r in results[-2:]] if len(results) >= 2 else [],
-                    "source": "日本蜡烛图技术"
-                }
-                results.append(entry)
-
-# ====== 写入输出文件 ======
-with open(output_jsonl, "w", encoding="utf-8") as f:
-    for item in results:
-        f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-print(f"✅ 共提取 {len(results)} 条结构化段落，写入文件：{output_jsonl}")
\ No newline at end of file
+# ====== JSONL 序列化：优先使用 orjson，未安装时回退到标准库 json ======
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+# ====== 主提取逻辑（边解析边写入输出文件） ======
+def main(pdf_path=pdf_path, output_jsonl=output_jsonl):
+    import fitz  # PyMuPDF，延迟导入：仅引用辅助函数时无需加载
+
+    doc = fitz.open(pdf_path)
+    source = pdf_path.split("/")[-1].replace(".pdf", "")  # 获取文件名作为来源
+    buffer = []
+    recent_texts = deque(maxlen=2)  # 最近两条段落文本，用作 context_window
+    count = 0
+    current_chapter = None
+    current_section = None
+
+    with open(output_jsonl, "wb") as f:
+        for page in doc:
+            page_number = page.number + 1
+            blocks = page.get_text("blocks")
+            for block in blocks:
+                for line in block[4].split("\n"):
+                    text = line.strip()
+                    if not text:
+                        continue
+
+                    # 检测章节、小节
+                    chapter_title = extract_chapter_title(text)
+                    if chapter_title:
+                        current_chapter = chapter_title
+                        continue
+
+                    section_title = extract_section_title(text)
+                    if section_title:
+                        current_section = section_title
+                        continue
+
+                    # 检测合法段落
+                    if not is_valid(text):
+                        continue
+
+                    fig_id = extract_figure(text)
+                    ptype = classify_type(text)
+
+                    # 图段进入缓冲
+                    if ptype == "图注":
+                        buffer.append({
+                            "text": text,
+                            "page": page_number,
+                            "chapter": current_chapter,
+                            "section_title": current_section,
+                            "figure": fig_id,
+                            "type": ptype,
+                            "source": source,
+                            "text_parts": [text]  # 图注及后续合并段落，定稿时一次性拼接
+                        })
+                        continue
+
+                    # 补全图注（合并下段）
+                    if buffer:
+                        fig_entry = buffer.pop()
+                        text_parts = fig_entry.pop("text_parts")
+                        text_parts.append(text)
+                        fig_entry["text_full"] = " ".join(text_parts)
+                        fig_entry["from_figure_merge"] = True
+                        fig_entry["context_window"] = []
+                        fig_entry["page"] = page_number
+                        fig_entry["chapter"] = current_chapter
+                        fig_entry["section_title"] = current_section
+                        fig_entry["source"] = source
+                        entry = fig_entry
+                    else:
+                        entry = {
+                            "text": text,
+                            "page": page_number,
+                            "chapter": current_chapter,
+                            "section_title": current_section,
+                            "figure": fig_id,
+                            "type": ptype,
+                            "context_window": list(recent_texts) if len(recent_texts) == 2 else [],
+                            "source": source
+                        }
+
+                    # 段落定稿后立即写入输出文件
+                    f.write(dumps_line(entry))
+                    recent_texts.append(entry["text"])
+                    count += 1
+
+    print(f"✅ 共提取 {count} 条结构化段落，写入文件：{output_jsonl}")
+    return count
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,8 +1,22 @@
-import fitz
+import os
 import re
 import json
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import lru_cache
+from itertools import repeat
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 序列化
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick  # 可选依赖：pyahocorasick，多模式子串匹配自动机
+except ImportError:
+    ahocorasick = None
 
 # ====== 路径配置 ======
 pdf_paths = [
@@ -28,6 +42,27 @@ keywords = [
     "扇形", "时间周期", "循环周期", "换手率", "板块轮动", "交叉市场分析"
 ]
 
+# ====== 术语类型判定关键词 ======
+term_keywords = ["形态", "模型", "K线", "线图", "指标", "术语"]
+
+# ====== 关键词匹配器：优先 Aho-Corasick 自动机，未安装时回退到预编译正则 ======
+def build_keyword_matcher(words):
+    """返回判断文本是否包含任一关键词的函数，耗时与关键词数量无关"""
+    if ahocorasick:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    pattern = re.compile("|".join(map(re.escape, words)))
+    return lambda text: pattern.search(text) is not None
+
+contains_keyword = build_keyword_matcher(keywords)
+contains_term_keyword = build_keyword_matcher(term_keywords)
+
+# ====== 页眉页脚裁剪 ======
+HEADER_FOOTER_MARGIN = 50  # 页面上下各裁掉的高度（pt），页眉页脚不参与文本提取
+
 # ====== 正则表达式模式 ======
 CHAPTER_TITLE_PATTERN = re.compile(r"^(第[一二三四五六七八九十百]+章)(\s|$)")
 SECTION_TITLE_PATTERN = re.compile(r"^((\d+\.)*\d+\s)?[\u4e00-\u9fa5_a-zA-Z0-9]+(：|:| )")
@@ -35,6 +70,12 @@ FIGURE_PATTERN = re.compile(r"(图\s*\d+(-\d+)?)")
 DEFINITION_PATTERN = re.compile(r".*?[是为指称叫属于构成]+.*?一种.*?[形态模型结构]?", re.IGNORECASE)
 ACTION_PATTERN = re.compile(r".*(买入|卖出|信号|建议|策略|触发).*")
 
+# ====== 正则快速预筛：不满足必要条件的行直接跳过正则匹配 ======
+CHAPTER_PREFIX = "第"                  # 章节标题必须以“第”开头
+SECTION_SEPARATORS = ("：", ":", " ")  # 小节标题必须包含的分隔符之一
+FIGURE_MARK = "图"                     # 图号必须包含“图”
+DEFINITION_MARK = "一种"               # 定义句必须包含“一种”
+
 # ====== 类型枚举 ======
 class EntryType(str, Enum):
     DEFINITION = "定义"
@@ -43,23 +84,27 @@ class EntryType(str, Enum):
     TERM = "术语"
     EXPLANATION = "说明"
 
-# ====== 提取章节标题 ======
+# ====== 提取章节标题（调用方传入已 strip 的文本） ======
 def extract_chapter_title(text):
-    match = CHAPTER_TITLE_PATTERN.match(text.strip())
+    if not text.startswith(CHAPTER_PREFIX):
+        return None
+    match = CHAPTER_TITLE_PATTERN.match(text)
     if match:
         return match.group(1)
     return None
 
-# ====== 提取小节标题 ======
+# ====== 提取小节标题（调用方传入已 strip 的文本） ======
 def extract_section_title(text):
-    if len(text.strip()) <= 50:
+    if len(text) <= 50 and any(sep in text for sep in SECTION_SEPARATORS):
         match = SECTION_TITLE_PATTERN.match(text)
         if match:
-            return text.strip()
+            return text
     return None
 
 # ====== 提取图号 ======
 def extract_figure(text):
+    if FIGURE_MARK not in text:
+        return None
     match = FIGURE_PATTERN.search(text)
     if match:
         return match.group(1)
@@ -67,23 +112,22 @@ def extract_figure(text):
 
 # ====== 识别类型 ======
 def classify_type(text):
-    if DEFINITION_PATTERN.search(text):
+    if DEFINITION_MARK in text and DEFINITION_PATTERN.search(text):
         return EntryType.DEFINITION
     elif ACTION_PATTERN.search(text):
         return EntryType.TRADING_LOGIC
     elif extract_figure(text):
         return EntryType.FIGURE_CAPTION
-    elif len(text) <= 40 and any(kw in text for kw in ["形态", "模型", "K线", "线图", "指标", "术语"]):
+    elif len(text) <= 40 and contains_term_keyword(text):
         return EntryType.TERM
     else:
         return EntryType.EXPLANATION
 
-# ====== 判断有效性 ======
+# ====== 判断有效性（调用方传入已 strip 的文本） ======
 def is_valid(text):
-    text = text.strip()
     if not (20 <= len(text) <= 500):
         return False
-    if not any(kw in text for kw in keywords):
+    if not contains_keyword(text):
         return False
     if re.search(r"(免责声明|版权所有|微信|扫码|www\.|http|\.cn|大学|出版社|本书由)", text):
         return False
@@ -91,92 +135,159 @@ def is_valid(text):
         return False
     return True
 
+# ====== 目录解析：由 PDF 书签直接得到各页的章节/小节 ======
+def build_toc_maps(toc):
+    """根据 doc.get_toc() 的 [[level, title, page], ...] 构建起始页到章节/小节标题的映射"""
+    page_to_chapter = {}
+    page_to_section = {}
+    for level, title, page in toc:
+        if page < 1:  # 无跳转目标的书签
+            continue
+        if level == 1:
+            page_to_chapter[page] = title.strip()
+            page_to_section[page] = None  # 新章节开始时清空小节
+        elif level == 2:
+            page_to_section[page] = title.strip()
+    return page_to_chapter, page_to_section
+
+# ====== JSONL 序列化：优先使用 orjson，未安装时回退到标准库 json ======
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+# ====== 单页解析（进程池工作函数） ======
+@lru_cache(maxsize=None)
+def open_document(pdf_path):
+    # fitz 文档不可跨进程共享，每个工作进程各自打开一次并复用
+    import fitz  # 延迟导入 PyMuPDF，仅引用辅助函数时无需加载
+    return fitz.open(pdf_path)
+
+def process_page(pdf_path, page_index, detect_titles=True):
+    """解析单页，返回不含章节/小节状态的行记录，由主进程按顺序拼接；有目录时不再逐行识别标题"""
+    import fitz
+
+    page = open_document(pdf_path)[page_index]
+    records = []
+    # 由 MuPDF 直接裁掉页眉页脚区域、合并断字并按阅读顺序排序文本块
+    clip = fitz.Rect(0, HEADER_FOOTER_MARGIN, page.rect.width, page.rect.height - HEADER_FOOTER_MARGIN)
+    flags = fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_DEHYPHENATE  # 在 "blocks" 默认标志上追加断字合并
+    blocks = page.get_text("blocks", clip=clip, flags=flags, sort=True)
+    for *_, block_text, _, _ in blocks:
+        for line in block_text.splitlines():
+            text = line.strip()
+            if not text:
+                continue
+
+            # 检测章节、小节
+            if detect_titles:
+                chapter_title = extract_chapter_title(text)
+                if chapter_title:
+                    records.append(("chapter", chapter_title))
+                    continue
+
+                section_title = extract_section_title(text)
+                if section_title:
+                    records.append(("section", section_title))
+                    continue
+
+            # 检测合法段落
+            if not is_valid(text):
+                continue
+
+            records.append(("text", text, extract_figure(text), classify_type(text).value))
+    return records
+
 # ====== 主提取逻辑 ======
-def extract_data(pdf_paths):
-    results = []
-    for pdf_path in pdf_paths:
-        doc = fitz.open(pdf_path)
-        source = pdf_path.split("/")[-1].replace(".pdf", "")  # 获取文件名作为来源
-        buffer = []
-        current_chapter = None
-        current_section = None
-
-        for page in doc:
-            page_number = page.number + 1
-            blocks = page.get_text("blocks")
-            for block in blocks:
-                for line in block[4].split("\n"):
-                    text = line.strip()
-                    if not text:
-                        continue
-
-                    # 检测章节、小节
-                    chapter_title = extract_chapter_title(text)
-                    if chapter_title:
-                        current_chapter = chapter_title
+def extract_data(pdf_paths, output_path):
+    import fitz  # 延迟导入 PyMuPDF，仅引用辅助函数时无需加载
+
+    count = 0
+    recent_texts = deque(maxlen=2)  # 最近两条段落文本，用作 context_window
+    with open(output_path, "wb") as outfile:
+        for pdf_path in pdf_paths:
+            with fitz.open(pdf_path) as doc:
+                page_count = doc.page_count
+                toc = doc.get_toc()
+            # 有目录时按书签确定章节/小节，仅在缺少目录时回退到逐行正则识别
+            page_to_chapter, page_to_section = build_toc_maps(toc)
+            use_toc = bool(page_to_chapter or page_to_section)
+            source = pdf_path.split("/")[-1].replace(".pdf", "")  # 获取文件名作为来源
+            buffer = []
+            current_chapter = None
+            current_section = None
+
+            # 各页并行解析，按页序返回后在主进程中顺序拼接章节状态与图注合并
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                pages = executor.map(process_page, repeat(pdf_path), range(page_count), repeat(not use_toc))
+                for page_number, records in enumerate(pages, start=1):
+                    if page_number in page_to_chapter:
+                        current_chapter = page_to_chapter[page_number]
                         logging.info(f"章节标题：{current_chapter}，来源：{source}")
-                        continue
-
-                    section_title = extract_section_title(text)
-                    if section_title:
-                        current_section = section_title
-                        logging.info(f"小节标题：{current_section}，来源：{source}")
-                        continue
-
-                    # 检测合法段落
-                    if not is_valid(text):
-                        continue
-
-                    fig_id = extract_figure(text)
-                    entry_type = classify_type(text)
-
-                    # 图段进入缓冲
-                    if entry_type == EntryType.FIGURE_CAPTION:
-                        buffer.append({
-                            "text": text,
-                            "page": page_number,
-                            "chapter": current_chapter,
-                            "section_title": current_section,
-                            "figure": fig_id,
-                            "type": entry_type.value,
-                            "source": source
-                        })
-                        continue
-
-                    # 补全图注（合并下段）
-                    if buffer:
-                        fig_entry = buffer.pop()
-                        fig_entry["text_full"] = fig_entry["text"] + " " + text
-                        fig_entry["from_figure_merge"] = True
-                        fig_entry["context_window"] = []
-                        fig_entry["page"] = page_number
-                        fig_entry["chapter"] = current_chapter
-                        fig_entry["section_title"] = current_section
-                        fig_entry["source"] = source
-                        results.append(fig_entry)
-                    else:
-                        entry = {
-                            "text": text,
-                            "page": page_number,
-                            "chapter": current_chapter,
-                            "section_title": current_section,
-                            "figure": fig_id,
-                            "type": entry_type.value,
-                            "context_window": [r["text"] for r in results[-2:]] if len(results) >= 2 else [],
-                            "source": source
-                        }
-                        results.append(entry)
-                    logging.debug(f"提取内容：{entry}，来源：{source}")
-        doc.close()
-    return results
-
-# ====== 写入输出文件 ======
-def write_to_jsonl(data, output_path):
-    with open(output_path, "w", encoding="utf-8") as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
-    logging.info(f"✅ 共提取 {len(data)} 条结构化段，写入文件：{output_path}")
+                    if page_number in page_to_section:
+                        current_section = page_to_section[page_number]
+                        if current_section:
+                            logging.info(f"小节标题：{current_section}，来源：{source}")
+
+                    for record in records:
+                        if record[0] == "chapter":
+                            current_chapter = record[1]
+                            logging.info(f"章节标题：{current_chapter}，来源：{source}")
+                            continue
+
+                        if record[0] == "section":
+                            current_section = record[1]
+                            logging.info(f"小节标题：{current_section}，来源：{source}")
+                            continue
+
+                        _, text, fig_id, entry_type = record
+
+                        # 图段进入缓冲
+                        if entry_type == EntryType.FIGURE_CAPTION:
+                            buffer.append({
+                                "text": text,
+                                "page": page_number,
+                                "chapter": current_chapter,
+                                "section_title": current_section,
+                                "figure": fig_id,
+                                "type": entry_type,
+                                "source": source,
+                                "text_parts": [text]  # 图注及后续合并段落，定稿时一次性拼接
+                            })
+                            continue
+
+                        # 补全图注（合并下段）
+                        if buffer:
+                            fig_entry = buffer.pop()
+                            text_parts = fig_entry.pop("text_parts")
+                            text_parts.append(text)
+                            fig_entry["text_full"] = " ".join(text_parts)
+                            fig_entry["from_figure_merge"] = True
+                            fig_entry["context_window"] = []
+                            fig_entry["page"] = page_number
+                            fig_entry["chapter"] = current_chapter
+                            fig_entry["section_title"] = current_section
+                            fig_entry["source"] = source
+                            entry = fig_entry
+                        else:
+                            entry = {
+                                "text": text,
+                                "page": page_number,
+                                "chapter": current_chapter,
+                                "section_title": current_section,
+                                "figure": fig_id,
+                                "type": entry_type,
+                                "context_window": list(recent_texts) if len(recent_texts) == 2 else [],
+                                "source": source
+                            }
+
+                        # 段落定稿后立即写入，不在内存中累积
+                        outfile.write(dumps_line(entry))
+                        recent_texts.append(entry["text"])
+                        count += 1
+                        logging.debug(f"提取内容：{entry}，来源：{source}")
+    logging.info(f"✅ 共提取 {count} 条结构化段，写入文件：{output_path}")
+    return count
 
 if __name__ == "__main__":
-    extracted_data = extract_data(pdf_paths)
-    write_to_jsonl(extracted_data, output_jsonl)
\ No newline at end of file
+    extract_data(pdf_paths, output_jsonl)
\ No newline at end of file
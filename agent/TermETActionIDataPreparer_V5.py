@@ -1,10 +1,24 @@
 import fitz  # PyMuPDF
 import re
 import json
+import os
 import logging
 from pathlib import Path
 from datetime import datetime
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+try:
+    import ahocorasick  # 可选依赖：pyahocorasick，多模式子串匹配自动机
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 序列化
+except ImportError:
+    orjson = None
 
 # ========= 日志配置 =========
 logging.basicConfig(
@@ -37,152 +51,202 @@ BOOKS = {
     }
 }
 
+# ========= 预编译正则 =========
+CHAPTER_RES = (
+    re.compile(r"^(第[一二三四五六七八九十百]+章)(\s|$)", re.IGNORECASE),
+    re.compile(r"^CHAPTER\s+\d+", re.IGNORECASE)
+)
+FIGURE_RE = re.compile(r"(图\d+(\.\d+)?|Figure\s+\d+(\.\d+)?)", re.IGNORECASE)
+DEFINITION_VERBS = frozenset("是为指称叫属于构成")  # 定义句中位于“一种”之前的判断词
+CHAPTER_FIRST_CHARS = frozenset("第Cc")  # 章节标题只可能以这些字符开头，其余文本无需进入正则
+NOISE_RE = re.compile(r"(免责声明|版权所有|微信|扫码|www\.|http|大学|出版社|图表来源|技术支持)")
+
+# ========= 关键词匹配器：优先 Aho-Corasick 自动机，未安装时回退到预编译正则 =========
+def build_keyword_matcher(words):
+    """返回判断文本是否包含任一关键词的函数，耗时与关键词数量无关"""
+    if ahocorasick:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    pattern = re.compile("|".join(map(re.escape, words)))
+    return lambda text: pattern.search(text) is not None
+
+contains_section_keyword = build_keyword_matcher(["形态", "模型", "K线", "线图", "指标", "趋势"])
+contains_action_keyword = build_keyword_matcher(["买入", "卖出", "信号", "建议", "触发", "策略"])
+contains_term_keyword = build_keyword_matcher(["形态", "模型", "K线", "指标"])
+
 # ========= 工具函数 =========
 def extract_chapter_title(text):
-    patterns = [
-        r"^(第[一二三四五六七八九十百]+章)(\s|$)",
-        r"^CHAPTER\s+\d+"
-    ]
-    for pat in patterns:
-        match = re.match(pat, text.strip(), re.IGNORECASE)
-        if match:
-            return text.strip()
+    text = text.strip()
+    if text[:1] not in CHAPTER_FIRST_CHARS:
+        return None
+    for pattern in CHAPTER_RES:
+        if pattern.match(text):
+            return text
     return None
 
 def extract_section_title(text):
-    if len(text.strip()) <= 50 and any(kw in text for kw in ["形态", "模型", "K线", "线图", "指标", "趋势"]):
+    if len(text.strip()) <= 50 and contains_section_keyword(text):
         return text.strip()
     return None
 
 def extract_figure(text):
-    match = re.search(r"(图\d+(\.\d+)?|Figure\s+\d+(\.\d+)?)", text, re.IGNORECASE)
+    # 图号必须包含“图”或（不区分大小写的）Figure，两者都不含时无需进入正则
+    if "图" not in text and "gure" not in text.lower():
+        return None
+    match = FIGURE_RE.search(text)
     return match.group(1) if match else None
 
-def classify_type(text):
-    if re.match(r".*?[是为指称叫属于构成]+.*?一种.*?[形态模型结构]?", text):
+def is_definition(text):
+    # 等价于 re.match(r".*?[是为指称叫属于构成]+.*?一种", text)：首行内某个判断词之后出现“一种”
+    # 用子串查找代替多段 .*? 回溯；“.” 不匹配换行，因此只看第一行
+    line = text.partition("\n")[0]
+    end = line.rfind("一种")
+    return end > 0 and not DEFINITION_VERBS.isdisjoint(line[:end])
+
+def classify_type(text, fig):
+    # fig 为调用方已提取的图号，避免重复执行图号正则
+    if is_definition(text):
         return "定义"
-    elif any(x in text for x in ["买入", "卖出", "信号", "建议", "触发", "策略"]):
+    elif contains_action_keyword(text):
         return "交易逻辑"
-    elif extract_figure(text):
+    elif fig:
         return "图注"
-    elif len(text) <= 60 and any(kw in text for kw in ["形态", "模型", "K线", "指标"]):
+    elif len(text) <= 60 and contains_term_keyword(text):
         return "术语"
     else:
         return "说明"
 
-def is_valid(text, keywords):
+def is_valid(text, contains_keyword):
     if not (15 <= len(text) <= 500):
         return False
-    if not any(kw in text for kw in keywords):
+    if not contains_keyword(text):
         return False
-    if re.search(r"(免责声明|版权所有|微信|扫码|www\.|http|大学|出版社|图表来源|技术支持)", text):
+    if NOISE_RE.search(text):
         return False
-    if text.endswith("：") or len(text.split()) < 2:
+    # 至少两个词：只需切分出前两段即可判断，不必构造整段的词列表
+    if text.endswith("：") or len(text.split(maxsplit=1)) < 2:
         return False
     return True
 
 def merge_lines(lines, max_len=120):
-    paragraph = ""
+    buf = []
+    length = -1  # 拼接后长度：各行长度之和加上 len(buf) - 1 个空格
     for line in lines:
-        if paragraph:
-            paragraph += " " + line.strip()
-        else:
-            paragraph = line.strip()
-        if len(paragraph) >= max_len:
-            yield paragraph
-            paragraph = ""
-    if paragraph:
-        yield paragraph
+        buf.append(line)
+        length += len(line) + 1
+        if length >= max_len:
+            yield " ".join(buf)
+            buf.clear()
+            length = -1
+    if buf:
+        yield " ".join(buf)
+
+# ========= JSONL 序列化：优先使用 orjson，未安装时回退到标准库 json =========
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
 
 # ========= 主提取逻辑 =========
 def process_book(book_name, config, debug=False):
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)  # spawn 方式启动的子进程不会继承主进程的日志级别
+
     pdf_path = Path(config["pdf"])
     if not pdf_path.exists():
         logging.warning(f"❌ 找不到PDF文件：{pdf_path}")
         return
 
     logging.info(f"📘 开始处理: {pdf_path.name}")
-    keywords = config["keywords"]
+    contains_keyword = build_keyword_matcher(config["keywords"])  # 每本书构建一次
     source = config["source"]
 
-    results = []
+    output_path = Path("data") / f"{book_name}_term_et_action_input_v7.jsonl"
+    count = 0
+    recent_texts = deque(maxlen=2)  # 最近两条段落文本，用作 context_window
     buffer = []
     chapter = None
     section = None
 
-    doc = fitz.open(pdf_path)
-    for page in doc:
-        page_number = page.number + 1
-        blocks = page.get_text("blocks")
-        lines = [line.strip() for block in blocks for line in block[4].split("\n") if line.strip()]
+    with fitz.open(pdf_path) as doc, open(output_path, "wb") as f:
+        for pno in range(doc.page_count):
+            page_number = pno + 1
+            # 按页号直接取整页纯文本，由 MuPDF 一次性拼接返回，避免逐块构造 Python 元组
+            lines = [line for line in map(str.strip, doc.get_page_text(pno).splitlines()) if line]
 
-        for para in merge_lines(lines):
-            chapter_title = extract_chapter_title(para)
-            if chapter_title:
-                chapter = chapter_title
-                continue
+            page_lines = []  # 本页定稿的记录，整页处理完后用 writelines 一次写入
 
-            section_title = extract_section_title(para)
-            if section_title:
-                section = section_title
-                continue
+            for para in merge_lines(lines):
+                chapter_title = extract_chapter_title(para)
+                if chapter_title:
+                    chapter = chapter_title
+                    continue
 
-            if debug:
-                logging.debug(f"🧪 Raw para: {para}")
+                section_title = extract_section_title(para)
+                if section_title:
+                    section = section_title
+                    continue
 
-            if not is_valid(para, keywords):
                 if debug:
-                    logging.debug(f"❌ 无效段落: {para}")
-                continue
-
-            fig = extract_figure(para)
-            ptype = classify_type(para)
-
-            if debug:
-                logging.debug(f"✅ 有效段落: {para} | 类型: {ptype} | 页码: {page_number}")
-
-            if ptype == "图注":
-                buffer.append({
-                    "text": para,
-                    "page": page_number,
-                    "chapter": chapter,
-                    "section_title": section,
-                    "figure": fig,
-                    "type": ptype,
-                    "source": source
-                })
-                continue
-
-            if buffer:
-                fig_entry = buffer.pop()
-                fig_entry.update({
-                    "text_full": fig_entry["text"] + " " + para,
-                    "from_figure_merge": True,
-                    "context_window": [],
-                    "page": page_number,
-                    "chapter": chapter,
-                    "section_title": section
-                })
-                results.append(fig_entry)
-            else:
-                entry = {
-                    "text": para,
-                    "page": page_number,
-                    "chapter": chapter,
-                    "section_title": section,
-                    "figure": fig,
-                    "type": ptype,
-                    "context_window": [r["text"] for r in results[-2:]] if len(results) >= 2 else [],
-                    "source": source
-                }
-                results.append(entry)
+                    logging.debug(f"🧪 Raw para: {para}")
 
-    output_path = Path("data") / f"{book_name}_term_et_action_input_v7.jsonl"
-    with open(output_path, "w", encoding="utf-8") as f:
-        for item in results:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                if not is_valid(para, contains_keyword):
+                    if debug:
+                        logging.debug(f"❌ 无效段落: {para}")
+                    continue
+
+                fig = extract_figure(para)
+                ptype = classify_type(para, fig)
+
+                if debug:
+                    logging.debug(f"✅ 有效段落: {para} | 类型: {ptype} | 页码: {page_number}")
+
+                if ptype == "图注":
+                    buffer.append({
+                        "text": para,
+                        "page": page_number,
+                        "chapter": chapter,
+                        "section_title": section,
+                        "figure": fig,
+                        "type": ptype,
+                        "source": source
+                    })
+                    continue
+
+                if buffer:
+                    fig_entry = buffer.pop()
+                    fig_entry.update({
+                        "text_full": fig_entry["text"] + " " + para,
+                        "from_figure_merge": True,
+                        "context_window": [],
+                        "page": page_number,
+                        "chapter": chapter,
+                        "section_title": section
+                    })
+                    entry = fig_entry
+                else:
+                    entry = {
+                        "text": para,
+                        "page": page_number,
+                        "chapter": chapter,
+                        "section_title": section,
+                        "figure": fig,
+                        "type": ptype,
+                        "context_window": list(recent_texts) if len(recent_texts) == 2 else [],
+                        "source": source
+                    }
+
+                page_lines.append(dumps_line(entry))
+                recent_texts.append(entry["text"])
+
+            # 按页批量写入，内存中最多只保留一页的记录
+            f.writelines(page_lines)
+            count += len(page_lines)
 
-    logging.info(f"✅ 写入 {len(results)} 条记录至：{output_path}")
+    logging.info(f"✅ 写入 {count} 条记录至：{output_path}")
 
 # ========= 主入口 =========
 if __name__ == "__main__":
@@ -193,6 +257,8 @@ if __name__ == "__main__":
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    for name, cfg in BOOKS.items():
+    # 各书籍相互独立，每本书在独立进程中打开 PDF 并解析
+    for name in BOOKS:
         logging.info(f"📖 正在处理书籍：{name}")
-        process_book(name, cfg, debug=args.debug)
\ No newline at end of file
+    with ProcessPoolExecutor(max_workers=min(len(BOOKS), os.cpu_count())) as executor:
+        list(executor.map(process_book, BOOKS.keys(), BOOKS.values(), repeat(args.debug)))
\ No newline at end of file
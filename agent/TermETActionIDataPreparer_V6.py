@@ -1,9 +1,22 @@
+import fitz  # PyMuPDF
 import json
 import re
+import os
 import logging
 from pathlib import Path
 import argparse
-from unstructured.partition.pdf import partition_pdf
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+try:
+    import ahocorasick  # 可选依赖：pyahocorasick，多模式子串匹配自动机
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 序列化
+except ImportError:
+    orjson = None
 
 # ========= 日志配置 =========
 logging.basicConfig(
@@ -25,76 +38,111 @@ BOOKS = {
     }
 }
 
+# ========= 关键词匹配器：优先 Aho-Corasick 自动机，未安装时回退到预编译正则 =========
+def build_keyword_matcher(words):
+    """返回判断文本是否包含任一关键词的函数，耗时与关键词数量无关"""
+    if ahocorasick:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return lambda text: next(automaton.iter(text), None) is not None
+    pattern = re.compile("|".join(map(re.escape, words)))
+    return lambda text: pattern.search(text) is not None
+
+contains_section_keyword = build_keyword_matcher(["形态", "模型", "K线", "趋势", "指标"])
+
 # ========= 工具函数 =========
-def is_valid(text, keywords):
+def is_valid(text, contains_keyword):
     if not (20 <= len(text) <= 500):
         return False
-    if not any(kw in text for kw in keywords):
+    if not contains_keyword(text):
         return False
     if re.search(r"(免责声明|版权所有|扫码|www|http|出版社)", text):
         return False
     return True
 
 def extract_chapter_title(text):
-    match = re.match(r"^(第[一二三四五六七八九十百]+章)", text.strip())
+    text = text.strip()
+    if not text.startswith("第"):  # 绝大多数文本不以“第”开头，直接跳过正则
+        return None
+    match = re.match(r"^(第[一二三四五六七八九十百]+章)", text)
     return match.group(1) if match else None
 
 def extract_section_title(text):
-    if len(text.strip()) <= 30 and any(kw in text for kw in ["形态", "模型", "K线", "趋势", "指标"]):
+    if len(text.strip()) <= 30 and contains_section_keyword(text):
         return text.strip()
     return None
 
+# ========= JSONL 序列化：优先使用 orjson，未安装时回退到标准库 json =========
+def dumps_line(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+# ========= 文本块提取：PyMuPDF 逐页返回文本块，块内换行与多余空白合并为单个空格 =========
+def iter_pages(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield page.number + 1, [" ".join(block[4].split()) for block in page.get_text("blocks")]
+
 # ========= 主提取逻辑 =========
 def process_book(book_name, config, debug=False):
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)  # spawn 方式启动的子进程不会继承主进程的日志级别
+
     pdf_path = Path(config["pdf"])
     if not pdf_path.exists():
         logging.error(f"找不到PDF文件：{pdf_path}")
         return
 
     logging.info(f"📘 开始处理: {pdf_path.name}")
+    contains_keyword = build_keyword_matcher(config["keywords"])  # 每本书构建一次
 
-    elements = partition_pdf(filename=str(pdf_path), strategy="fast")
-    results = []
+    output_path = Path("data") / f"{book_name}_term_et_action_input_v8.jsonl"
+    count = 0
     chapter = None
     section = None
 
-    for element in elements:
-        text = element.text.strip()
-        if debug:
-            logging.debug(f"🔍 提取文本: {text[:50]}")
-
-        if not text:
-            continue
-
-        chapter_title = extract_chapter_title(text)
-        if chapter_title:
-            chapter = chapter_title
-            continue
-
-        section_title = extract_section_title(text)
-        if section_title:
-            section = section_title
-            continue
-
-        if not is_valid(text, config["keywords"]):
-            if debug:
-                logging.debug(f"❌ 无效文本: {text[:50]}")
-            continue
-
-        results.append({
-            "text": text,
-            "page": element.metadata.page_number,
-            "chapter": chapter,
-            "section_title": section,
-            "source": config["source"]
-        })
+    with open(output_path, "wb") as f:
+        for page_number, texts in iter_pages(pdf_path):
+            page_lines = []  # 本页定稿的记录，整页处理完后用 writelines 一次写入
 
-    output_path = Path("data") / f"{book_name}_term_et_action_input_v8.jsonl"
-    with open(output_path, "w", encoding="utf-8") as f:
-        for item in results:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            for text in texts:
+                if debug:
+                    logging.debug(f"🔍 提取文本: {text[:50]}")
+
+                if not text:
+                    continue
+
+                chapter_title = extract_chapter_title(text)
+                if chapter_title:
+                    chapter = chapter_title
+                    continue
+
+                section_title = extract_section_title(text)
+                if section_title:
+                    section = section_title
+                    continue
+
+                if not is_valid(text, contains_keyword):
+                    if debug:
+                        logging.debug(f"❌ 无效文本: {text[:50]}")
+                    continue
+
+                page_lines.append(dumps_line({
+                    "text": text,
+                    "page": page_number,
+                    "chapter": chapter,
+                    "section_title": section,
+                    "source": config["source"]
+                }))
+
+            # 按页批量写入，内存中最多只保留一页的记录
+            f.writelines(page_lines)
+            count += len(page_lines)
 
-    logging.info(f"✅ {book_name} 提取完成，共 {len(results)} 条记录，已写入：{output_path}")
+    logging.info(f"✅ {book_name} 提取完成，共 {count} 条记录，已写入：{output_path}")
 
 # ========= 主入口 =========
 if __name__ == "__main__":
@@ -105,6 +153,8 @@ if __name__ == "__main__":
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    for name, cfg in BOOKS.items():
+    # 各书籍相互独立，每本书在独立进程中打开 PDF 并解析
+    for name in BOOKS:
         logging.info(f"📚 正在处理书籍：{name}")
-        process_book(name, cfg, debug=args.debug)
\ No newline at end of file
+    with ProcessPoolExecutor(max_workers=min(len(BOOKS), os.cpu_count())) as executor:
+        list(executor.map(process_book, BOOKS.keys(), BOOKS.values(), repeat(args.debug)))
\ No newline at end of file
@@ -1,13 +1,22 @@
 import json
 import os
+import re
 import logging
 
+try:
+    import orjson  # 可选依赖：C 实现的 JSON 解析
+except ImportError:
+    orjson = None
+
 # 文件路径
 INPUT_FILE = "data/term_et_action_output_data.jsonl"
 OUTPUT_MD_FILE = "data/term_et_action_cards.md"
 ERROR_LOG_FILE = "log/error_lines.log"
 REPORT_LOG_FILE="log/term_et_action_report.log"
 
+# 提取模型输出中 ```json 代码块的内容，缺少结尾标记时取到末尾
+FENCE_PATTERN = re.compile(r"^```json\s*(.*?)\s*(?:```)?\s*$", re.DOTALL)
+
 
 # 设置日志配置
 logging.basicConfig(
@@ -18,9 +27,13 @@ logging.basicConfig(
     encoding='utf-8'
 )
 
-# 渲染单张知识卡片为 Markdown
+# JSON 解析：优先使用 orjson，未安装时回退到标准库 json
+def loads_json(text):
+    return orjson.loads(text) if orjson else json.loads(text)
+
+# 渲染单张知识卡片为 Markdown 片段列表，由调用方统一写入，不再为每张卡片拼接整段字符串
 def render_card(card_json):
-    return f"""
+    parts = [f"""
 ## 📘 {card_json.get("indicator_name", "未命名指标")}
 
 - **图示**：{card_json.get("figure_ref", "无")}
@@ -30,10 +43,13 @@ def render_card(card_json):
   > {card_json.get("signal_logic", "无信号逻辑")}
 
 ### ❓ 问答：
-""" + "\n".join([
-        f"- **Q**: {qa.get('Q', '无问题')}\n  - **A**: {qa.get('A', '无答案')}"
-        for qa in card_json.get("qa_pairs", [])
-    ])
+"""]
+    for qa in card_json.get("qa_pairs", []):
+        parts.append(f"- **Q**: {qa.get('Q', '无问题')}\n  - **A**: {qa.get('A', '无答案')}")
+        parts.append("\n")
+    if len(parts) > 1:
+        parts.pop()  # 问答之间以换行分隔，末尾不留换行
+    return parts
 
 # 主函数
 def main():
@@ -42,7 +58,8 @@ def main():
         print("❌ 输入文件为空或不存在，请检查路径或内容。")
         return
 
-    cards = []
+    parts = []  # 所有卡片的 Markdown 片段，卡片之间插入分隔线
+    card_count = 0
     error_lines = []
 
     with open(INPUT_FILE, "r", encoding="utf-8") as infile:
@@ -50,12 +67,17 @@ def main():
             try:
                 if not line.strip():
                     continue
-                entry = json.loads(line)
-
-                if isinstance(entry.get("output"), str) and entry["output"].startswith("```json"):
-                    json_str = entry["output"].strip("`json\n").rstrip("`").strip()
-                    card_json = json.loads(json_str)
-                    cards.append(render_card(card_json))
+                entry = loads_json(line)
+
+                output = entry.get("output")
+                match = FENCE_PATTERN.match(output) if isinstance(output, str) else None
+                if match:
+                    card_json = loads_json(match.group(1))
+                    card_parts = render_card(card_json)
+                    if card_count:
+                        parts.append("\n---\n")
+                    parts.extend(card_parts)
+                    card_count += 1
                     logging.info(f"✅ 第{i+1}行转换成功：{card_json.get('indicator_name', '未知')}")
                 else:
                     raise ValueError("output 字段不是预期格式")
@@ -69,17 +91,17 @@ def main():
             errlog.write("\n".join(error_lines))
         logging.warning(f"⚠️ 有 {len(error_lines)} 行出错，详情见 {ERROR_LOG_FILE}")
 
-    if not cards:
+    if not card_count:
         logging.error("⚠️ 没有成功生成任何卡片。")
         print("⚠️ 没有生成任何有效卡片，请检查日志。")
         return
 
     with open(OUTPUT_MD_FILE, "w", encoding="utf-8") as outfile:
         outfile.write("# 📚 股票术语知识卡片\n\n")
-        outfile.write("\n---\n".join(cards))
+        outfile.writelines(parts)
 
-    logging.info(f"✅ 成功生成 {len(cards)} 张卡片，已写入 {OUTPUT_MD_FILE}")
-    print(f"✅ 生成完成，{len(cards)} 张卡片已写入 {OUTPUT_MD_FILE}")
+    logging.info(f"✅ 成功生成 {card_count} 张卡片，已写入 {OUTPUT_MD_FILE}")
+    print(f"✅ 生成完成，{card_count} 张卡片已写入 {OUTPUT_MD_FILE}")
 
 if __name__ == "__main__":
     main()
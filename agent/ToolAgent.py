@@ -4,20 +4,21 @@ from typing import Dict, Any, List
 
 
 def mcp(name: str = None,
-        useage: str = None,
+        usage: str = None,
         purpose: str = None,
         features: List[str] = None):
     """MCP协议Agent类装饰器"""
 
     def decorator(cls):
+        # 写入属性背后的字段，而不是用普通方法覆盖同名property
         if name is not None:
-            cls.name = lambda self: name
-        if useage is not None:
-            cls.useage = lambda self: useage
+            cls._name = name
+        if usage is not None:
+            cls._usage = usage
         if purpose is not None:
-            cls.purpose = lambda self: purpose
+            cls._purpose = purpose
         if features is not None:
-            cls.features = lambda self: features
+            cls._features = features
         return cls
 
     return decorator
@@ -40,6 +41,36 @@ def tool_call(description: str = "",
 class ToolAgent(ABC):
     """符合MCP协议的Agent抽象基类"""
 
+    # 被tool_call注解的方法表，子类定义时由__init_subclass__生成
+    _tool_call_cache: Dict[str, Dict[str, Any]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """子类定义时扫描一次tool_call方法，避免每次访问都做反射"""
+        super().__init_subclass__(**kwargs)
+        cls._tool_call_cache = cls._collect_tool_calls()
+
+    @classmethod
+    def _collect_tool_calls(cls) -> Dict[str, Dict[str, Any]]:
+        """收集所有带有tool_call注解的方法及其属性"""
+        methods = {}
+        seen = set()
+
+        # 沿MRO直接遍历各类的__dict__，子类中的同名属性优先，避免getmembers的全量取值与排序
+        for klass in cls.__mro__:
+            if klass is object:
+                break
+            for name, method in vars(klass).items():
+                if name in seen:
+                    continue
+                seen.add(name)
+                if inspect.isfunction(method) and hasattr(method, 'tool_description'):
+                    methods[name] = {
+                        'description': getattr(method, 'tool_description', ''),
+                        'input_schema': getattr(method, 'input_schema', {}),
+                        'output_schema': getattr(method, 'output_schema', {})
+                    }
+
+        return dict(sorted(methods.items()))  # 与getmembers一致按名称排序
 
     @property
     def name(self) -> str:
@@ -52,22 +83,22 @@ class ToolAgent(ABC):
     @property
     def purpose(self) -> str:
         """用途列表"""
-        if self.purpose is not None:
-            return self.purpose
+        if getattr(self, '_purpose', None) is not None:
+            return self._purpose
         return "Generic ToolAgent purpose"
 
     @property
     def features(self) -> List[str]:
         """特性列表"""
-        if self.features is not None:
-            return self.features
+        if getattr(self, '_features', None) is not None:
+            return self._features
         return ["Generic ToolAgent features"]
 
     @property
-    def useage(self) -> str:
+    def usage(self) -> str:
         """使用说明"""
-        if self.useage is not None:
-            return self.useage
+        if getattr(self, '_usage', None) is not None:
+            return self._usage
         return "This is a generic ToolAgent."
 
     @property
@@ -75,7 +106,7 @@ class ToolAgent(ABC):
         """Agent名片信息"""
         return {
             "name": self.name,
-            "useage": self.usage,
+            "usage": self.usage,
             "purpose": self.purpose,
             "features": self.features,
             "tools": self.tool_call_behavior
@@ -84,18 +115,8 @@ class ToolAgent(ABC):
 
     @property
     def tool_call_behavior(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有带有tool_call注解的方法及其属性"""
-        methods = {}
-
-        for name, method in inspect.getmembers(self.__class__, inspect.isfunction):
-            if hasattr(method, 'tool_description'):
-                methods[name] = {
-                    'description': getattr(method, 'tool_description', ''),
-                    'input_schema': getattr(method, 'input_schema', {}),
-                    'output_schema': getattr(method, 'output_schema', {})
-                }
-
-        return methods
+        """获取所有带有tool_call注解的方法及其属性（类定义时已缓存）"""
+        return type(self)._tool_call_cache
 
 
 
@@ -83,6 +83,34 @@ class ToolAgent(ABC):
     _purpose: Optional[str] = None
     _usage: Optional[str] = None
     _features: Optional[List[str]] = None
+    # Filled in once per subclass by __init_subclass__
+    _tool_call_cache: Dict[str, Dict[str, Any]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """Scan @tool_call methods once, when the subclass is defined."""
+        super().__init_subclass__(**kwargs)
+        cls._tool_call_cache = cls._collect_tool_calls()
+
+    @classmethod
+    def _collect_tool_calls(cls) -> Dict[str, Dict[str, Any]]:
+        """Collects methods decorated with @tool_call and their attributes."""
+        methods = {}
+        seen = set()
+        # Walk each class __dict__ along the MRO; the most derived definition of a name wins.
+        for klass in cls.__mro__:
+            if klass is object:
+                break
+            for name, method in vars(klass).items():
+                if name in seen:
+                    continue
+                seen.add(name)
+                if inspect.isfunction(method) and hasattr(method, "tool_description"):
+                    methods[name] = {
+                        "description": getattr(method, "tool_description", ""),
+                        "input_schema": getattr(method, "input_schema", {}),
+                        "output_schema": getattr(method, "output_schema", {}),
+                    }
+        return dict(sorted(methods.items()))  # sorted by name, as inspect.getmembers did
 
     @property
     def name(self) -> str:
@@ -122,16 +150,8 @@ class ToolAgent(ABC):
     def tool_call_behavior(self) -> Dict[str, Dict[str, Any]]:
         """Retrieves methods decorated with @tool_call and their attributes.
 
-        This property dynamically inspects the class to find methods
-        decorated with the `tool_call` decorator and extracts the
-        associated metadata (description, input schema, and output schema).
+        The class is inspected once, when it is defined, to find methods
+        decorated with the `tool_call` decorator; this property returns
+        the cached metadata (description, input schema, and output schema).
         """
-        methods = {}
-        for name, method in inspect.getmembers(self.__class__, inspect.isfunction):
-            if hasattr(method, "tool_description"):
-                methods[name] = {
-                    "description": getattr(method, "tool_description", ""),
-                    "input_schema": getattr(method, "input_schema", {}),
-                    "output_schema": getattr(method, "output_schema", {}),
-                }
-        return methods
+        return type(self)._tool_call_cache
@@ -83,6 +83,34 @@ class ToolAgent(ABC):
     _purpose: Optional[str] = None
     _usage: Optional[str] = None
     _features: Optional[List[str]] = None
+    # 被@tool_call装饰的方法表，子类定义时由__init_subclass__生成
+    _tool_call_cache: Dict[str, Dict[str, Any]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """子类定义时扫描一次被@tool_call装饰的方法，避免每次访问都做反射。"""
+        super().__init_subclass__(**kwargs)
+        cls._tool_call_cache = cls._collect_tool_calls()
+
+    @classmethod
+    def _collect_tool_calls(cls) -> Dict[str, Dict[str, Any]]:
+        """收集所有被@tool_call装饰的方法及其属性。"""
+        methods = {}
+        seen = set()
+        # 沿MRO直接遍历各类的__dict__，子类中的同名属性优先，避免getmembers的全量取值与排序
+        for klass in cls.__mro__:
+            if klass is object:
+                break
+            for name, method in vars(klass).items():
+                if name in seen:
+                    continue
+                seen.add(name)
+                if inspect.isfunction(method) and hasattr(method, "tool_description"):
+                    methods[name] = {
+                        "description": getattr(method, "tool_description", ""),
+                        "input_context": getattr(method, "input_context", {}),
+                        "output_context": getattr(method, "output_context", {}),
+                    }
+        return dict(sorted(methods.items()))  # 与getmembers一致按名称排序
 
     @property
     def name(self) -> str:
@@ -122,14 +150,6 @@ class ToolAgent(ABC):
     def tool_call_behavior(self) -> Dict[str, Dict[str, Any]]:
         """获取所有被@tool_call装饰的方法及其属性。
 
-        该属性动态检查类，查找被tool_call装饰的方法，并提取相关数据（description、input_context、output_context）。
+        类定义时已检查一次被tool_call装饰的方法，此处直接返回缓存的数据（description、input_context、output_context）。
         """
-        methods = {}
-        for name, method in inspect.getmembers(self.__class__, inspect.isfunction):
-            if hasattr(method, "tool_description"):
-                methods[name] = {
-                    "description": getattr(method, "tool_description", ""),
-                    "input_context": getattr(method, "input_context", {}),
-                    "output_context": getattr(method, "output_context", {}),
-                }
-        return methods
\ No newline at end of file
+        return type(self)._tool_call_cache
\ No newline at end of file
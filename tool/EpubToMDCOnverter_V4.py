@@ -2,12 +2,85 @@ import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup
 import html2text
+import html
 import os
 import base64
 from datetime import datetime
 import re
 from tqdm import tqdm
 from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import lxml  # 可选依赖：C 实现的 HTML 解析器，BeautifulSoup 可直接使用
+except ImportError:
+    lxml = None
+
+try:
+    import pybase64  # 可选依赖：SIMD 实现的 base64 编码
+except ImportError:
+    pybase64 = None
+
+# BeautifulSoup 解析器：优先使用 lxml，未安装时回退到标准库 html.parser
+HTML_PARSER = 'lxml' if lxml else 'html.parser'
+
+# 原始HTML中的<img>标签（属性值内可以出现'>'）及标签内的属性
+IMG_TAG_RE = re.compile(r"""<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+TAG_ATTR_RE = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?""")
+
+# 嵌入模式下<img>的src先替换为占位引用，写出Markdown时再流式写入对应图片的base64数据
+EMBED_REF_PREFIX = 'epub-embed-image:'
+EMBED_REF_RE = re.compile(re.escape(EMBED_REF_PREFIX) + r'(\d+)')
+
+# Markdown中的一级标题行
+H1_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+# 删除文件名中非法字符的转换表
+INVALID_FILENAME_TABLE = str.maketrans('', '', '\\/*?:"<>|')
+
+# 媒体类型到文件扩展名的映射
+IMAGE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/svg+xml': '.svg'
+}
+
+
+# base64编码：优先使用 pybase64，未安装时回退到标准库 base64
+def b64encode_str(content: bytes) -> str:
+    if pybase64:
+        return pybase64.b64encode_as_string(content)
+    return base64.b64encode(content).decode('ascii')
+
+
+def write_data_url(fp, image: dict, chunk_size: int = 3 * 16 * 1024) -> None:
+    """将图片以data URL形式分块写入文本文件，块大小为3的倍数，各块编码结果可直接拼接"""
+    fp.write(f"data:{image['media_type']};base64,")
+    view = memoryview(image['content'])
+    for start in range(0, len(view), chunk_size):
+        fp.write(b64encode_str(view[start:start + chunk_size]))
+
+
+# 章节转换子进程中的图片引用映射，由进程初始化函数设置一次，不随每个任务传递
+_worker_image_map = {}
+
+
+def _init_worker(image_map: dict) -> None:
+    global _worker_image_map
+    _worker_image_map = image_map
+
+
+def _convert_chapter(html_bytes: bytes) -> str:
+    """在子进程中解码章节、替换图片引用并转换为Markdown
+
+    html2text转换器会把上一章末尾的状态带入下一章，这里每章使用新的转换器，
+    转换结果与章节分配到哪个进程无关
+    """
+    reader = EpubReader(None)
+    processed_html = reader._process_html_content(html_bytes.decode('utf-8'), _worker_image_map)
+    return reader.html2text.handle(processed_html)
 
 
 class EpubReader:
@@ -94,7 +167,7 @@ class EpubReader:
 
     def get_chapter_content(self, chapter):
         try:
-            soup = BeautifulSoup(chapter.get_content(), 'html.parser')
+            soup = BeautifulSoup(chapter.get_content(), HTML_PARSER)
             h = html2text.HTML2Text()
             h.ignore_links = True
             h.ignore_images = True
@@ -107,16 +180,15 @@ class EpubReader:
         print("-" * 50)
 
         chapters_found = False
-        for item in self.book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                chapters_found = True
-                print(f"\n文档ID: {item.id}")
-                content = self.get_chapter_content(item)
-                preview = content[:max_preview_length]
-                if len(content) > max_preview_length:
-                    preview += "..."
-                print(preview + "\n")
-                print("-" * 50)
+        for item in self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+            chapters_found = True
+            print(f"\n文档ID: {item.id}")
+            content = self.get_chapter_content(item)
+            preview = content[:max_preview_length]
+            if len(content) > max_preview_length:
+                preview += "..."
+            print(preview + "\n")
+            print("-" * 50)
 
         if not chapters_found:
             print("没有找到章节内容")
@@ -135,22 +207,17 @@ class EpubReader:
 
     def _clean_filename(self, filename: str) -> str:
         """清理文件名，移除非法字符"""
-        return re.sub(r'[\\/*?:"<>|]', '', filename)
+        return filename.translate(INVALID_FILENAME_TABLE)
 
     def _get_chapter_markdown(self, chapter) -> str:
         """将章节内容转换为Markdown格式"""
         try:
-            # 解析HTML内容
-            soup = BeautifulSoup(chapter.get_content(), 'html.parser')
-
-            # 获取标题
-            title = ""
-            h1 = soup.find('h1')
-            if h1:
-                title = h1.get_text().strip()
+            # 直接转换为Markdown，不再为了查找<h1>单独解析一遍HTML
+            markdown = self.html2text.handle(chapter.get_content().decode('utf-8'))
 
-            # 转换为Markdown
-            markdown = self.html2text.handle(str(soup))
+            # 获取标题：<h1>转换后即为Markdown中的一级标题
+            match = H1_RE.search(markdown)
+            title = match.group(1).strip() if match else ""
 
             # 如果有标题，确保它在文档开头并使用一级标题格式
             if title and not markdown.startswith(f"# {title}"):
@@ -162,18 +229,17 @@ class EpubReader:
 
     def _extract_images(self):
         """提取epub中的所有图片"""
-        for item in self.book.get_items():
-            if item.get_type() == ebooklib.ITEM_IMAGE:
-                # 获取图片ID和内容
-                image_id = item.id
-                image_content = item.content
-                image_name = unquote(item.file_name.split('/')[-1])
-
-                self.images[image_id] = {
-                    'content': image_content,
-                    'name': image_name,
-                    'media_type': item.media_type
-                }
+        for item in self.book.get_items_of_type(ebooklib.ITEM_IMAGE):
+            # 获取图片ID和内容
+            image_id = item.id
+            image_content = item.content
+            image_name = unquote(item.file_name.split('/')[-1])
+
+            self.images[image_id] = {
+                'content': image_content,
+                'name': image_name,
+                'media_type': item.media_type
+            }
 
     def _save_images(self, output_dir: str) -> dict:
         """
@@ -194,9 +260,8 @@ class EpubReader:
 
             # 保存图片
             image_path = os.path.join(assets_dir, safe_name)
-            image_name=safe_name.split('/')[-1].split('.')[0]
-            with open(image_path, 'wb') as f:
-                f.write(image_data['content'])
+            image_name = os.path.splitext(image_data['name'])[0]  # 以原始文件名为键，与<img>的src对应
+            Path(image_path).write_bytes(image_data['content'])  # 整张图片一次写入
 
             # 存储相对路径
             image_paths[image_name] = os.path.join('assets', safe_name)
@@ -205,34 +270,49 @@ class EpubReader:
 
     def _get_extension(self, media_type: str) -> str:
         """根据媒体类型获取文件扩展名"""
-        extensions = {
-            'image/jpeg': '.jpg',
-            'image/png': '.png',
-            'image/gif': '.gif',
-            'image/svg+xml': '.svg'
-        }
-        return extensions.get(media_type, '.jpg')
+        return IMAGE_EXTENSIONS.get(media_type, '.jpg')
 
     def _process_html_content(self, html_content: str, image_paths: dict) -> str:
-        """处理HTML内容，替换图片引用"""
-        soup = BeautifulSoup(html_content, 'html.parser')
-
-        # 处理图片标签
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-
-            # 提取图片ID
-            image_name = src.split('/')[-1].split('.')[0]
+        """处理HTML内容，替换图片引用
 
-            if image_name in image_paths:
-                # 更新图片源为相对路径
-                img['src'] = image_paths[image_name]
-
-                # 添加alt文本
-                if not img.get('alt'):
-                    img['alt'] = f"Image {image_name}"
-
-        return str(soup)
+        直接在原始HTML上改写<img>标签，交给html2text时只需解析一次
+        """
+        # 前言、目录、版权页等大多数章节没有图片，子串查找即可跳过（标签名不区分大小写）
+        if '<img' not in html_content.lower():
+            return html_content
+        return IMG_TAG_RE.sub(lambda match: self._rewrite_img_tag(match, image_paths), html_content)
+
+    def _rewrite_img_tag(self, match, image_map: dict) -> str:
+        """改写单个<img>标签的src和alt，未命中映射的标签原样返回"""
+        tag = match.group(0)
+        attrs = []
+        for attr in TAG_ATTR_RE.finditer(tag, 4):
+            value = attr.group(2) or ''
+            if value[:1] in ('"', "'"):
+                value = value[1:-1]
+            attrs.append((attr.group(1).lower(), html.unescape(value)))
+
+        src = next((value for name, value in attrs if name == 'src'), '')
+        image_name = os.path.splitext(unquote(src.rpartition('/')[2]))[0]  # src中的文件名经过URL编码
+        if image_name not in image_map:
+            return tag
+
+        # 更新图片源，缺少alt文本时补上
+        attrs = [(name, image_map[image_name] if name == 'src' else value) for name, value in attrs]
+        if not next((value for name, value in attrs if name == 'alt'), ''):
+            attrs = [(name, value) for name, value in attrs if name != 'alt']
+            attrs.append(('alt', f"Image {image_name}"))
+        return '<img' + ''.join(f' {name}="{html.escape(value)}"' for name, value in attrs) + '/>'
+
+    def _convert_documents(self, image_map: dict):
+        """用进程池并行转换所有文档，按原顺序逐章返回Markdown"""
+        # 原始字节直接交给子进程，解码也在子进程中并行完成
+        documents = [
+            item.get_content()
+            for item in self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
+        ]
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker, initargs=(image_map,)) as executor:
+            yield from tqdm(executor.map(_convert_chapter, documents, chunksize=4), total=len(documents))
 
     def save_as_markdown(self, output_dir: str = None) -> None:
         """将epub内容保存为Markdown文件"""
@@ -258,42 +338,36 @@ class EpubReader:
         # 保存图片并获取路径映射
         image_paths = self._save_images(output_dir)
 
-        # 创建README.md
-        readme_path = os.path.join(output_dir, "README.md")
-        with open(readme_path, "w", encoding="utf-8") as f:
-            f.write(f"# {book_title}\n\n")
-            f.write("## 图书信息\n\n")
-            for key, value in self.metadata.items():
-                f.write(f"- **{key.capitalize()}**: {value}\n")
-            f.write("\n## 目录\n\n")
-
-        # 保存章节内容
+        # 保存章节内容，目录项先收集在内存中
         print("\n开始转换章节...")
+        toc = []
         chapter_index = 1
-        for item in tqdm(self.book.get_items()):
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                # 处理HTML内容
-                processed_html = self._process_html_content(item.get_content().decode('utf-8'), image_paths)
-
-                # 转换为Markdown
-                markdown_content = self.html2text.handle(processed_html)
+        for markdown_content in self._convert_documents(image_paths):
+            # 生成章节文件名
+            chapter_filename = f"chapter_{chapter_index:03d}.md"
+            chapter_path = os.path.join(output_dir, chapter_filename)
 
-                # 生成章节文件名
-                chapter_filename = f"chapter_{chapter_index:03d}.md"
-                chapter_path = os.path.join(output_dir, chapter_filename)
+            # 保存章节内容
+            with open(chapter_path, "w", encoding="utf-8") as f:
+                f.write(markdown_content)
 
-                # 保存章节内容
-                with open(chapter_path, "w", encoding="utf-8") as f:
-                    f.write(markdown_content)
+            # 记录目录项
+            title = markdown_content.split('\n', 1)[0].lstrip("#").strip()
+            if not title:
+                title = f"Chapter {chapter_index}"
+            toc.append((title, chapter_filename))
 
-                # 更新README.md
-                with open(readme_path, "a", encoding="utf-8") as f:
-                    title = markdown_content.split('\n', 1)[0].lstrip("#").strip()
-                    if not title:
-                        title = f"Chapter {chapter_index}"
-                    f.write(f"- [{title}]({chapter_filename})\n")
+            chapter_index += 1
 
-                chapter_index += 1
+        # 创建README.md，章节全部转换后一次写入图书信息和目录
+        readme_path = os.path.join(output_dir, "README.md")
+        with open(readme_path, "w", encoding="utf-8") as readme:
+            readme.write(f"# {book_title}\n\n")
+            readme.write("## 图书信息\n\n")
+            for key, value in self.metadata.items():
+                readme.write(f"- **{key.capitalize()}**: {value}\n")
+            readme.write("\n## 目录\n\n")
+            readme.writelines(f"- [{title}]({chapter_filename})\n" for title, chapter_filename in toc)
 
         print(f"\n转换完成！")
         print(f"- 文件保存在: {output_dir}")
@@ -337,16 +411,10 @@ class EpubReader:
 
             # 写入章节内容
             chapter_count = 0
-            for item in tqdm(self.book.get_items()):
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    # 处理HTML内容
-                    processed_html = self._process_html_content(item.get_content().decode('utf-8'), image_paths)
-
-                    # 转换为Markdown
-                    markdown_content = self.html2text.handle(processed_html)
-                    f.write(f"\n{markdown_content}\n")
-                    f.write("\n---\n\n")
-                    chapter_count += 1
+            for markdown_content in self._convert_documents(image_paths):
+                f.write(f"\n{markdown_content}\n")
+                f.write("\n---\n\n")
+                chapter_count += 1
 
         print(f"\n转换完成！")
         print(f"- 文件保存为: {output_path}")
@@ -379,13 +447,13 @@ class EpubReader:
         if not output_path:
             output_path = f"{book_title}_single.md"
 
-        # 创建图片ID到base64数据的映射
-        image_data = {}
-        for image_id, img in self.images.items():
-            # 转换为base64
-            b64_data = base64.b64encode(img['content']).decode()
-            # 创建data URL
-            image_data[image_id] = f"data:{img['media_type']};base64,{b64_data}"
+        # 图片文件名（不含扩展名）对应按序号编号的占位引用，子进程只处理这些短字符串，
+        # base64数据在主进程写出时才逐块生成
+        images = list(self.images.values())
+        image_refs = {
+            os.path.splitext(img['name'])[0]: f"{EMBED_REF_PREFIX}{index}"
+            for index, img in enumerate(images)
+        }
 
         print(f"\n开始转换为单个独立Markdown文件...")
 
@@ -399,32 +467,19 @@ class EpubReader:
 
             # 写入章节内容
             chapter_count = 0
-            for item in tqdm(self.book.get_items()):
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    # 处理HTML内容，替换图片引用为base64数据
-                    soup = BeautifulSoup(item.get_content().decode('utf-8'), 'html.parser')
-
-                    # 处理图片标签
-                    for img in soup.find_all('img'):
-                        src = img.get('src', '')
-                        # 提取图片ID
-                        image_id = src.split('/')[-1].split('.')[0]
-
-                        if image_id in image_data:
-                            # 更新图片源为base64数据
-                            img['src'] = image_data[image_id]
-
-                            # 添加alt文本
-                            if not img.get('alt'):
-                                img['alt'] = f"Image {image_id}"
-
-                    # 转换为Markdown
-                    markdown_content = self.html2text.handle(str(soup))
-                    f.write(f"\n{markdown_content}\n")
-                    f.write("\n---\n\n")
-                    chapter_count += 1
+            for markdown_content in self._convert_documents(image_refs):
+                f.write("\n")
+                # split 结果中奇数位置为占位引用的图片序号
+                for index, part in enumerate(EMBED_REF_RE.split(markdown_content)):
+                    if index % 2:
+                        write_data_url(f, images[int(part)])
+                    else:
+                        f.write(part)
+                f.write("\n")
+                f.write("\n---\n\n")
+                chapter_count += 1
 
         print(f"\n转换完成！")
         print(f"- 文件保存为: {output_path}")
         print(f"- 总计转换 {chapter_count} 个章节")
-        print(f"- 总计嵌入 {len(image_data)} 张图片")
\ No newline at end of file
+        print(f"- 总计嵌入 {len(image_refs)} 张图片")
\ No newline at end of file
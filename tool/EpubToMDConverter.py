@@ -4,9 +4,17 @@ import argparse
 import pathlib
 import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from ebooklib import epub
 
+try:
+    import lxml  # 可选依赖：C 实现的 HTML 解析器，BeautifulSoup 可直接使用
+except ImportError:
+    lxml = None
+
+# BeautifulSoup 解析器：优先使用 lxml，未安装时回退到标准库 html.parser
+HTML_PARSER = "lxml" if lxml else "html.parser"
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -27,14 +35,13 @@ def extract_epub(epub_path, output_dir):
             if item.media_type.startswith("image/"):
                 image_ext = item.media_type.split("/")[-1]
                 image_path = images_dir / f"image_{image_count:04d}.{image_ext}"
-                with open(image_path, "wb") as f:
-                    f.write(item.get_content())
+                image_path.write_bytes(item.get_content())  # 整张图片一次写入
                 image_count += 1
                 logger.debug(f"✅ 提取图片: {image_path}")
 
             # ✅ 文档识别方式：HTML/XHTML 内容
             elif item.media_type in ["application/xhtml+xml", "text/html"]:
-                soup = BeautifulSoup(item.get_content(), "html.parser")
+                soup = BeautifulSoup(item.get_content(), HTML_PARSER)
                 title_tag = soup.find(['h1', 'h2', 'h3'])
                 title = title_tag.get_text(strip=True).replace(" ", "_") if title_tag else f"chapter_{len(chapters)+1}"
                 filename = f"{len(chapters)+1:02d}_{title}.html"
@@ -66,10 +73,10 @@ def batch_convert_to_markdown(chapter_files, output_dir):
     md_dir = output_dir / "markdown"
     md_dir.mkdir(exist_ok=True)
 
-    for html_file in chapter_files:
-        md_filename = html_file.stem + ".md"
-        md_path = md_dir / md_filename
-        convert_html_to_md(html_file, md_path)
+    # 每章一个 pandoc 进程，多个进程并发运行，不再逐个等待进程启动和退出
+    md_paths = [md_dir / (html_file.stem + ".md") for html_file in chapter_files]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(convert_html_to_md, chapter_files, md_paths))
 
     print(f"📄 所有章节已转换为 Markdown，路径：{md_dir}")
     return md_dir
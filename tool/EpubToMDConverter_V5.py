@@ -1,12 +1,15 @@
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
 import html2text
+import html
+import hashlib
 import os
-import base64
+from binascii import b2a_base64
 import re
 from tqdm import tqdm
 from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import logging
 
 # 配置日志
@@ -34,6 +37,20 @@ METADATA_FIELDS = {
     'subject': ('DC', 'subject')
 }
 
+# 删除文件名中非法字符的转换表
+INVALID_FILENAME_TABLE = str.maketrans('', '', '\\/*?:"<>|')
+
+# 嵌入模式下<img>的src先替换为占位引用，写出Markdown时再流式写入对应图片的base64数据
+EMBED_REF_PREFIX = 'epub-embed-image:'
+EMBED_REF_RE = re.compile(re.escape(EMBED_REF_PREFIX) + r'(\d+)')
+
+# Markdown中的一级标题行
+H1_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+# 原始HTML中的<img>标签（属性值内可以出现'>'）及标签内的属性
+IMG_TAG_RE = re.compile(r"""<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+TAG_ATTR_RE = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?""")
+
 IMAGE_EXTENSIONS = {
     'image/jpeg': '.jpg',
     'image/png': '.png',
@@ -42,9 +59,71 @@ IMAGE_EXTENSIONS = {
 }
 
 
+# Markdown缓存格式版本：修改 _init_html_converter 中的转换选项后需要递增，使旧缓存失效
+MARKDOWN_CACHE_VERSION = 1
+
+
+def _basename_noext(path: str) -> str:
+    """取路径最后一段并去掉扩展名，用作图片映射的键"""
+    tail = path.rpartition('/')[2]
+    return tail.rpartition('.')[0] or tail
+
+
+# 章节转换子进程中的图片引用映射和Markdown缓存目录，由进程初始化函数设置一次，不随每个任务传递
+_worker_image_map = {}
+_worker_cache_dir = None
+
+
+def _init_worker(image_map: dict, cache_dir) -> None:
+    global _worker_image_map, _worker_cache_dir
+    _worker_image_map = image_map
+    _worker_cache_dir = Path(cache_dir) if cache_dir else None
+
+
+def _convert_chapter(html_bytes: bytes) -> tuple:
+    """在子进程中替换图片引用并转换为Markdown，返回 (Markdown, 错误信息)
+
+    html2text 转换器会把上一章末尾的状态带入下一章，这里每章使用新的转换器，
+    转换结果只取决于替换图片引用后的HTML，因此可以按其内容哈希缓存
+    """
+    try:
+        converter = EpubToMDConverter(None)
+        processed_html = converter._process_html_content(html_bytes.decode('utf-8'), _worker_image_map)
+        if not _worker_cache_dir:
+            return converter.html2text.handle(processed_html), None
+
+        key = f"{MARKDOWN_CACHE_VERSION}\0{html2text.__version__}\0{processed_html}"
+        cache_path = _worker_cache_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.md"
+        try:
+            return cache_path.read_text(encoding='utf-8'), None
+        except OSError:
+            pass
+
+        markdown_content = converter.html2text.handle(processed_html)
+        # 先写临时文件再改名，多个进程同时缓存相同章节时不会读到写了一半的文件
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp_path.write_text(markdown_content, encoding='utf-8')
+            os.replace(tmp_path, cache_path)
+            tmp_path = None
+        except Exception as e:
+            logger.warning(f"写入Markdown缓存失败: {str(e)}")
+        finally:
+            if tmp_path:
+                try:
+                    tmp_path.unlink()
+                except OSError:
+                    pass
+        return markdown_content, None
+    except Exception as e:
+        return None, str(e)
+
+
 class EpubToMDConverter:
-    def __init__(self, epub_path):
+    def __init__(self, epub_path, cache_dir=None):
+        """cache_dir: Markdown缓存目录（如 ~/.cache/epub2md），重复转换同一本书时跳过未变化的章节；默认不缓存"""
         self.epub_path = epub_path
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
         self.book = None
         self.metadata = {}
         self.images = {}
@@ -123,11 +202,10 @@ class EpubToMDConverter:
 
     def get_chapter_content(self, chapter):
         try:
-            soup = BeautifulSoup(chapter.get_content(), 'html.parser')
             h = html2text.HTML2Text()
             h.ignore_links = True
             h.ignore_images = True
-            return h.handle(str(soup))
+            return h.handle(chapter.get_content().decode('utf-8'))
         except Exception as e:
             logger.error(f"解析章节内容时出错: {str(e)}")
             return f"解析章节内容时出错: {str(e)}"
@@ -138,16 +216,15 @@ class EpubToMDConverter:
         print("-" * 50)
 
         chapters_found = False
-        for item in self.book.get_items():
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                chapters_found = True
-                print(f"\n文档ID: {item.id}")
-                content = self.get_chapter_content(item)
-                preview = content[:max_preview_length]
-                if len(content) > max_preview_length:
-                    preview += "..."
-                print(preview + "\n")
-                print("-" * 50)
+        for item in self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+            chapters_found = True
+            print(f"\n文档ID: {item.id}")
+            content = self.get_chapter_content(item)
+            preview = content[:max_preview_length]
+            if len(content) > max_preview_length:
+                preview += "..."
+            print(preview + "\n")
+            print("-" * 50)
 
         if not chapters_found:
             logger.warning("没有找到章节内容")
@@ -170,14 +247,13 @@ class EpubToMDConverter:
 
     def _clean_filename(self, filename: str) -> str:
         """清理文件名，移除非法字符"""
-        return re.sub(r'[\\/*?:"<>|]', '', filename)
+        return filename.translate(INVALID_FILENAME_TABLE)
 
     def _get_chapter_markdown(self, chapter) -> str:
         """将章节内容转换为Markdown格式"""
         try:
-            soup = BeautifulSoup(chapter.get_content(), 'html.parser')
-            title = self._get_chapter_title(soup)
-            markdown = self.html2text.handle(str(soup))
+            markdown = self.html2text.handle(chapter.get_content().decode('utf-8'))
+            title = self._get_chapter_title(markdown)
             if title and not markdown.startswith(f"# {title}"):
                 markdown = f"# {title}\n\n{markdown}"
             return markdown
@@ -185,24 +261,23 @@ class EpubToMDConverter:
             logger.error(f"转换章节内容时出错: {str(e)}")
             return f"转换章节内容时出错: {str(e)}"
 
-    def _get_chapter_title(self, soup):
-        """获取章节标题"""
-        h1 = soup.find('h1')
-        return h1.get_text().strip() if h1 else ""
+    def _get_chapter_title(self, markdown: str) -> str:
+        """获取章节标题：<h1>转换后即为Markdown中的一级标题"""
+        match = H1_RE.search(markdown)
+        return match.group(1).strip() if match else ""
 
     def _extract_images(self):
         """提取epub中的所有图片"""
         logger.info("开始提取epub中的所有图片")
-        for item in self.book.get_items():
-            if item.get_type() == ebooklib.ITEM_IMAGE:
-                image_id = item.id
-                image_content = item.content
-                image_name = unquote(item.file_name.split('/')[-1])
-                self.images[image_id] = {
-                    'content': image_content,
-                    'name': image_name,
-                    'media_type': item.media_type
-                }
+        for item in self.book.get_items_of_type(ebooklib.ITEM_IMAGE):
+            image_id = item.id
+            image_content = item.content
+            image_name = unquote(item.file_name.rpartition('/')[2])
+            self.images[image_id] = {
+                'content': image_content,
+                'name': image_name,
+                'media_type': item.media_type
+            }
         logger.info(f"成功提取 {len(self.images)} 张图片")
 
     def _save_images(self, output_dir: str) -> dict:
@@ -213,7 +288,7 @@ class EpubToMDConverter:
         for image_id, image_data in self.images.items():
             safe_name = self._get_safe_image_name(image_data)
             image_path = os.path.join(assets_dir, safe_name)
-            image_name = safe_name.split('/')[-1].split('.')[0]
+            image_name = _basename_noext(image_data['name'])  # 以原始文件名为键，与<img>的src对应
             try:
                 self._write_file(image_path, image_data['content'])
                 image_paths[image_name] = os.path.join('assets', safe_name)
@@ -246,17 +321,45 @@ class EpubToMDConverter:
 
     def _process_html_content(self, html_content: str, image_paths: dict) -> str:
         """处理HTML内容，替换图片引用"""
-        logger.info("开始处理HTML内容，替换图片引用")
-        soup = BeautifulSoup(html_content, 'html.parser')
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            image_name = src.split('/')[-1].split('.')[0]
-            if image_name in image_paths:
-                img['src'] = image_paths[image_name]
-                if not img.get('alt'):
-                    img['alt'] = f"Image {image_name}"
-        logger.info("HTML内容处理完成")
-        return str(soup)
+        logger.debug("开始处理HTML内容，替换图片引用")
+        html_content = IMG_TAG_RE.sub(lambda match: self._rewrite_img_tag(match, image_paths), html_content)
+        logger.debug("HTML内容处理完成")
+        return html_content
+
+    def _rewrite_img_tag(self, match, image_map: dict) -> str:
+        """改写单个<img>标签的src和alt，未命中映射的标签原样返回"""
+        tag = match.group(0)
+        attrs = []
+        for attr in TAG_ATTR_RE.finditer(tag, 4):
+            value = attr.group(2) or ''
+            if value[:1] in ('"', "'"):
+                value = value[1:-1]
+            attrs.append((attr.group(1).lower(), html.unescape(value)))
+
+        src = next((value for name, value in attrs if name == 'src'), '')
+        image_name = _basename_noext(unquote(src))  # src中的文件名经过URL编码
+        if image_name not in image_map:
+            return tag
+
+        attrs = [(name, image_map[image_name] if name == 'src' else value) for name, value in attrs]
+        if not next((value for name, value in attrs if name == 'alt'), ''):
+            attrs = [(name, value) for name, value in attrs if name != 'alt']
+            attrs.append(('alt', f"Image {image_name}"))
+        return '<img' + ''.join(f' {name}="{html.escape(value)}"' for name, value in attrs) + '/>'
+
+    def _convert_documents(self, image_map: dict):
+        """用进程池并行转换所有文档，按原顺序逐章返回 (Markdown, 错误信息)
+
+        image_map 为图片文件名到资源路径或嵌入占位引用的映射
+        """
+        documents = [
+            item.get_content()
+            for item in self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
+        ]
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker, initargs=(image_map, self.cache_dir)) as executor:
+            yield from tqdm(executor.map(_convert_chapter, documents, chunksize=4), total=len(documents))
 
     def _write_metadata_to_file(self, file_path, book_title):
         """将元数据写入文件"""
@@ -287,15 +390,16 @@ class EpubToMDConverter:
 
         logger.info("开始转换章节...")
         chapter_index = 1
-        for item in tqdm(self.book.get_items()):
-            if item.get_type() == ebooklib.ITEM_DOCUMENT:
+        with open(readme_path, "a", encoding="utf-8") as readme:  # 整个转换过程只打开一次
+            for markdown_content, error in self._convert_documents(image_paths):
+                if error:
+                    logger.error(f"保存章节 {chapter_index} 失败: {error}")
+                    continue
                 try:
-                    processed_html = self._process_html_content(item.get_content().decode('utf-8'), image_paths)
-                    markdown_content = self.html2text.handle(processed_html)
                     chapter_filename = f"chapter_{chapter_index:03d}.md"
                     chapter_path = os.path.join(output_dir, chapter_filename)
                     self._write_file(chapter_path, markdown_content.encode('utf-8'))
-                    self._update_readme(readme_path, markdown_content, chapter_filename, chapter_index)
+                    self._update_readme(readme, markdown_content, chapter_filename, chapter_index)
                     chapter_index += 1
                 except Exception as e:
                     logger.error(f"保存章节 {chapter_index} 失败: {str(e)}")
@@ -310,14 +414,13 @@ class EpubToMDConverter:
                 return False
         return True
 
-    def _update_readme(self, readme_path, markdown_content, chapter_filename, chapter_index):
-        """更新 README 文件"""
+    def _update_readme(self, readme, markdown_content, chapter_filename, chapter_index):
+        """向已打开的 README 文件追加目录项"""
         try:
             title = markdown_content.split('\n', 1)[0].lstrip("#").strip()
             if not title:
                 title = f"Chapter {chapter_index}"
-            with open(readme_path, "a", encoding="utf-8") as f:
-                f.write(f"- [{title}]({chapter_filename})\n")
+            readme.write(f"- [{title}]({chapter_filename})\n")
         except Exception as e:
             logger.error(f"更新 README 文件失败: {str(e)}")
 
@@ -355,16 +458,16 @@ class EpubToMDConverter:
                 f.write("\n---\n\n")
 
                 chapter_count = 0
-                for item in tqdm(self.book.get_items()):
-                    if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                        try:
-                            processed_html = self._process_html_content(item.get_content().decode('utf-8'), image_paths)
-                            markdown_content = self.html2text.handle(processed_html)
-                            f.write(f"\n{markdown_content}\n")
-                            f.write("\n---\n\n")
-                            chapter_count += 1
-                        except Exception as e:
-                            logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
+                for markdown_content, error in self._convert_documents(image_paths):
+                    if error:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {error}")
+                        continue
+                    try:
+                        # 章节内容与分隔线作为片段交给 writelines，不再拼接出一份整章大小的新字符串
+                        f.writelines(("\n", markdown_content, "\n", "\n---\n\n"))
+                        chapter_count += 1
+                    except Exception as e:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
 
             self._print_conversion_summary(output_path, chapter_count, len(image_paths), output_path)
         except Exception as e:
@@ -379,7 +482,7 @@ class EpubToMDConverter:
         self._extract_images()
         book_title = self._clean_filename(self.metadata.get('title', 'unknown_book'))
         output_path = output_path or f"{book_title}_single.md"
-        image_data = self._encode_images_to_base64()
+        images, image_refs = self._build_image_refs()
 
         logger.info(f"\n开始转换为单个独立Markdown文件...")
         print(f"\n开始转换为单个独立Markdown文件...")
@@ -390,39 +493,36 @@ class EpubToMDConverter:
                 f.write("\n---\n\n")
 
                 chapter_count = 0
-                for item in tqdm(self.book.get_items()):
-                    if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                        try:
-                            soup = BeautifulSoup(item.get_content().decode('utf-8'), 'html.parser')
-                            self._replace_images_with_base64(soup, image_data)
-                            markdown_content = self.html2text.handle(str(soup))
-                            f.write(f"\n{markdown_content}\n")
-                            f.write("\n---\n\n")
-                            chapter_count += 1
-                        except Exception as e:
-                            logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
-
-            self._print_conversion_summary(output_path, chapter_count, len(image_data), output_path)
+                for markdown_content, error in self._convert_documents(image_refs):
+                    if error:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {error}")
+                        continue
+                    try:
+                        f.write("\n")
+                        # split 结果中奇数位置为占位引用的图片序号
+                        for index, part in enumerate(EMBED_REF_RE.split(markdown_content)):
+                            if index % 2:
+                                self._write_data_url(f, images[int(part)])
+                            else:
+                                f.write(part)
+                        f.write("\n\n---\n\n")
+                        chapter_count += 1
+                    except Exception as e:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
+
+            self._print_conversion_summary(output_path, chapter_count, len(image_refs), output_path)
         except Exception as e:
             logger.error(f"保存单个独立Markdown文件失败: {str(e)}")
 
-    def _encode_images_to_base64(self):
-        """将图片编码为 base64 数据"""
-        image_data = {}
-        for image_id, img in self.images.items():
-            try:
-                b64_data = base64.b64encode(img['content']).decode()
-                image_data[image_id] = f"data:{img['media_type']};base64,{b64_data}"
-            except Exception as e:
-                logger.error(f"处理图片 {image_id} 为base64数据失败: {str(e)}")
-        return image_data
-
-    def _replace_images_with_base64(self, soup, image_data):
-        """将 HTML 中的图片引用替换为 base64 数据"""
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            image_id = src.split('/')[-1].split('.')[0]
-            if image_id in image_data:
-                img['src'] = image_data[image_id]
-                if not img.get('alt'):
-                    img['alt'] = f"Image {image_id}"
\ No newline at end of file
+    def _build_image_refs(self):
+        """为每张图片分配序号占位引用，子进程只处理这些短字符串，返回 (图片列表, 图片文件名到占位引用的映射)"""
+        images = list(self.images.values())
+        image_refs = {_basename_noext(img['name']): f"{EMBED_REF_PREFIX}{index}" for index, img in enumerate(images)}
+        return images, image_refs
+
+    def _write_data_url(self, f, img, chunk_size=3 * 16 * 1024):
+        """将图片以 data URL 形式分块写入文本文件，块大小为 3 的倍数，各块编码结果可直接拼接"""
+        f.write(f"data:{img['media_type']};base64,")
+        view = memoryview(img['content'])
+        for start in range(0, len(view), chunk_size):
+            f.write(b2a_base64(view[start:start + chunk_size], newline=False).decode('ascii'))
@@ -1,18 +1,27 @@
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
 import html2text
+import html
+import hashlib
 import os
+import json
 import base64
 import re
 from tqdm import tqdm
 from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor
 import logging
 from dataclasses import dataclass
+from functools import lru_cache
 from enum import Enum
 from typing import Dict, Optional, Any, List, Tuple
 from abc import ABC, abstractmethod
 
+try:
+    import pybase64  # 可选依赖：SIMD 实现的 base64 编码
+except ImportError:
+    pybase64 = None
+
 # ============= 配置模块 =============
 @dataclass
 class ConverterConfig:
@@ -42,6 +51,28 @@ METADATA_FIELDS = {
     'subject': ('DC', 'subject')
 }
 
+# 文件名中的非法字符及删除这些字符的转换表
+INVALID_FILENAME_CHARS = frozenset('\\/*?:"<>|')
+INVALID_FILENAME_TABLE = str.maketrans('', '', '\\/*?:"<>|')
+
+# 原始HTML中的<img>标签（属性值内可以出现'>'）及标签内的属性
+IMG_TAG_RE = re.compile(r"""<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+TAG_ATTR_RE = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?""")
+
+# 嵌入模式下<img>的src先替换为占位引用，写出Markdown时再流式写入对应图片的base64数据
+EMBED_REF_PREFIX = 'epub-embed-image:'
+EMBED_REF_RE = re.compile(re.escape(EMBED_REF_PREFIX) + r'(\d+)')
+
+# 单文件输出的写缓冲区大小，章节内容攒够后再整块写入磁盘
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# 解析结果缓存格式版本，缓存内容结构变化时递增，使旧缓存失效
+# 缓存文件首行为JSON索引（元数据及各图片、文档的字节长度），其后依次拼接图片和文档的原始字节
+BOOK_CACHE_VERSION = 2
+
+# Markdown中的一级标题行
+H1_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
 IMAGE_EXTENSIONS = {
     'image/jpeg': '.jpg',
     'image/png': '.png',
@@ -51,13 +82,15 @@ IMAGE_EXTENSIONS = {
 
 # ============= 日志模块 =============
 def setup_logger():
-    """配置日志"""
+    """配置日志：控制台输出INFO及以上，日志文件只记录WARNING及以上"""
+    file_handler = logging.FileHandler('epub_converter.log', encoding='utf-8')
+    file_handler.setLevel(logging.WARNING)
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - [%(levelname)s] - %(message)s',
         handlers=[
             logging.StreamHandler(),
-            logging.FileHandler('epub_converter.log', encoding='utf-8')
+            file_handler
         ]
     )
     return logging.getLogger(__name__)
@@ -81,7 +114,10 @@ class MetadataExtractionError(EpubConverterError):
 class FileUtils:
     @staticmethod
     def clean_filename(filename: str) -> str:
-        return re.sub(r'[\\/*?:"<>|]', '', filename)
+        # 绝大多数文件名不含非法字符，先用集合判断，避免无谓地生成新字符串
+        if INVALID_FILENAME_CHARS.isdisjoint(filename):
+            return filename
+        return filename.translate(INVALID_FILENAME_TABLE)
 
     @staticmethod
     def create_directory(base_dir: str, sub_dir: str) -> str:
@@ -91,21 +127,44 @@ class FileUtils:
 
     @staticmethod
     def write_file(path: str, content: bytes) -> None:
-        with open(path, 'wb') as f:
-            f.write(content)
+        """直接用文件描述符写入，不经过 Python 的缓冲 I/O 层"""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
 
 # ============= 图片处理模块 =============
+# base64 编码：优先使用 pybase64，未安装时回退到标准库 base64
+def b64encode_str(content) -> str:
+    if pybase64:
+        return pybase64.b64encode_as_string(content)
+    return base64.b64encode(content).decode('ascii')
+
 class ImageProcessor:
     @staticmethod
     def get_extension(media_type: str) -> str:
         return IMAGE_EXTENSIONS.get(media_type, '.jpg')
 
     @staticmethod
-    def encode_to_base64(content: bytes, media_type: str) -> str:
-        b64_data = base64.b64encode(content).decode()
-        return f"data:{media_type};base64,{b64_data}"
+    def write_base64_to(fp, content: bytes, media_type: str, chunk_size: int = 3 * 16 * 1024) -> None:
+        """将图片以 data URL 形式分块写入文本文件，块大小为 3 的倍数，各块编码结果可直接拼接"""
+        fp.write(f"data:{media_type};base64,")
+        view = memoryview(content)
+        for start in range(0, len(view), chunk_size):
+            fp.write(b64encode_str(view[start:start + chunk_size]))
 
 # ============= HTML处理模块 =============
+@lru_cache(maxsize=4096)
+def _src_to_key(src: str) -> str:
+    """<img>的src转换为图片映射的键：URL解码后的文件名（不含扩展名）
+
+    同一张图片常被多个章节引用，缓存后重复的src只需一次字典查找
+    """
+    return os.path.splitext(unquote(src.rpartition('/')[2]))[0]
+
 class HtmlProcessor:
     @staticmethod
     def init_html_converter() -> html2text.HTML2Text:
@@ -118,24 +177,81 @@ class HtmlProcessor:
         return converter
 
     @staticmethod
-    def get_chapter_title(soup: BeautifulSoup) -> str:
-        h1 = soup.find('h1')
-        return h1.get_text().strip() if h1 else ""
+    def get_chapter_title(markdown: str) -> str:
+        """<h1>转换后即为Markdown中的一级标题"""
+        match = H1_RE.search(markdown)
+        return match.group(1).strip() if match else ""
+
+    @staticmethod
+    def rewrite_images(html_content: str, image_map: Dict[str, str], add_alt: bool = True) -> str:
+        """直接在原始HTML上改写<img>标签的src（缺少alt时可补上），交给html2text时只需解析一次"""
+        # 没有可替换的图片时（书中无图片）任何<img>都不会被改写，跳过整个扫描
+        if not image_map:
+            return html_content
+
+        def rewrite(match):
+            tag = match.group(0)
+            attrs = []
+            for attr in TAG_ATTR_RE.finditer(tag, 4):
+                value = attr.group(2) or ''
+                if value[:1] in ('"', "'"):
+                    value = value[1:-1]
+                attrs.append((attr.group(1).lower(), html.unescape(value)))
+
+            src = next((value for name, value in attrs if name == 'src'), '')
+            image_key = _src_to_key(src)
+            if image_key not in image_map:
+                return tag
+
+            attrs = [(name, image_map[image_key] if name == 'src' else value) for name, value in attrs]
+            if add_alt and not next((value for name, value in attrs if name == 'alt'), ''):
+                attrs = [(name, value) for name, value in attrs if name != 'alt']
+                attrs.append(('alt', f"Image {image_key}"))
+            return '<img' + ''.join(f' {name}="{html.escape(value)}"' for name, value in attrs) + '/>'
+
+        return IMG_TAG_RE.sub(rewrite, html_content)
+
+# ============= 并行转换模块 =============
+# 章节转换子进程中的图片引用映射，由进程初始化函数设置一次，不随每个任务传递
+_worker_image_map: Dict[str, str] = {}
+_worker_add_alt = True
+
+def _init_worker(image_map: Dict[str, str], add_alt: bool) -> None:
+    global _worker_image_map, _worker_add_alt
+    _worker_image_map = image_map
+    _worker_add_alt = add_alt
+
+def _convert_chapter(html_bytes: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """在子进程中转换单个章节，返回 (Markdown, 错误信息)
+
+    html2text 转换器会把上一章末尾的状态带入下一章，这里每章使用新的转换器，
+    转换结果与章节分配到哪个进程无关
+    """
+    try:
+        converter = EpubToMDConverter(None)
+        markdown = converter._convert_chapter_to_markdown(html_bytes.decode('utf-8'), _worker_image_map, _worker_add_alt)
+        return markdown, None
+    except Exception as e:
+        return None, str(e)
 
 # ============= 主转换器类 =============
 class EpubToMDConverter:
-    def __init__(self, epub_path: str):
+    def __init__(self, epub_path: str, cache_dir: Optional[str] = None):
+        """cache_dir: 解析结果缓存目录，重复转换同一本书时跳过EPUB解析；默认不缓存"""
         self.epub_path = epub_path
+        self.cache_dir = cache_dir
         self.book = None
         self.metadata = {}
         self.images = {}
+        self.documents = []
+        self._items_loaded = False
         self.html2text = HtmlProcessor.init_html_converter()
         self.file_utils = FileUtils()
         self.image_processor = ImageProcessor()
 
     def _ensure_book_loaded(self) -> bool:
         """确保书籍已加载"""
-        if not self.book:
+        if not self.book and not self._load_cached_items():
             if not self.load_book():
                 logger.error("预加载书籍失败，操作终止")
                 return False
@@ -165,6 +281,92 @@ class EpubToMDConverter:
             logger.error(f"加载epub文件失败: {str(e)}")
             return False
 
+    def _cache_path(self) -> Optional[str]:
+        """缓存文件路径，由EPUB的绝对路径、修改时间和大小决定，文件变化后自动失效"""
+        if not self.cache_dir:
+            return None
+        stat = os.stat(self.epub_path)
+        key = f"{BOOK_CACHE_VERSION}\0{os.path.abspath(self.epub_path)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.cache")
+
+    def _load_cached_items(self) -> bool:
+        """从缓存读取元数据、图片和文档，命中时无需再解析EPUB；缓存缺失或损坏时返回False，改为解析EPUB"""
+        if self._items_loaded:
+            return True
+        try:
+            cache_path = self._cache_path()
+            if not cache_path:
+                return False
+            with open(cache_path, 'rb') as f:
+                index = json.loads(f.readline())
+                metadata = index['metadata']
+                if not isinstance(metadata, dict):
+                    raise ValueError("元数据格式错误")
+                images = {}
+                for image_key, name, media_type, size in index['images']:
+                    content = f.read(size)
+                    if len(content) != size:
+                        raise ValueError("图片数据不完整")
+                    images[image_key] = {'content': content, 'name': name, 'media_type': media_type}
+                documents = []
+                for size in index['documents']:
+                    content = f.read(size)
+                    if len(content) != size:
+                        raise ValueError("文档数据不完整")
+                    documents.append(content)
+                if f.read(1):
+                    raise ValueError("缓存文件末尾有多余数据")
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"读取书籍缓存失败，改为解析EPUB: {str(e)}")
+            return False
+        self.metadata, self.images, self.documents = metadata, images, documents
+        self._items_loaded = True
+        logger.info(f"从缓存加载书籍: {cache_path}")
+        return True
+
+    def _save_cached_items(self) -> None:
+        """写入缓存；写入失败只记录警告，不影响本次转换"""
+        tmp_path = None
+        try:
+            cache_path = self._cache_path()
+            if not cache_path:
+                return
+            index = {
+                'metadata': self.metadata,
+                'images': [[image_key, image['name'], image['media_type'], len(image['content'])]
+                           for image_key, image in self.images.items()],
+                'documents': [len(document) for document in self.documents]
+            }
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 先写临时文件再改名，中途失败不会留下写了一半的缓存
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(index, ensure_ascii=False, default=str).encode('utf-8') + b"\n")
+                f.writelines(image['content'] for image in self.images.values())
+                f.writelines(self.documents)
+            os.replace(tmp_path, cache_path)
+            tmp_path = None
+        except Exception as e:
+            logger.warning(f"写入书籍缓存失败: {str(e)}")
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _load_items(self) -> None:
+        """提取元数据、图片和文档，同一实例只提取一次，启用缓存时写入缓存文件"""
+        # 书籍已解析说明缓存未命中，不再重复读取缓存
+        if self._items_loaded or (not self.book and self._load_cached_items()):
+            return
+        self._extract_metadata()
+        self._extract_items()
+        self._items_loaded = True
+        self._save_cached_items()
+
     def _extract_metadata(self) -> None:
         """提取元数据"""
         if not self.book:
@@ -178,34 +380,38 @@ class EpubToMDConverter:
         except Exception as e:
             raise MetadataExtractionError(f"提取元数据失败: {str(e)}")
 
-    def _extract_images(self) -> None:
-        """提取所有图片"""
-        logger.info("开始提取epub中的所有图片")
+    def _extract_items(self) -> None:
+        """一次遍历提取所有图片和文档内容"""
+        logger.info("开始提取epub中的所有图片和文档")
+        self.documents = []
         for item in self.book.get_items():
-            if item.get_type() == ebooklib.ITEM_IMAGE:
-                image_id = item.id
+            item_type = item.get_type()
+            if item_type == ebooklib.ITEM_DOCUMENT:
+                self.documents.append(item.get_content())
+            elif item_type == ebooklib.ITEM_IMAGE:
                 image_content = item.content
                 image_name = unquote(item.file_name.split('/')[-1])
-                logger.info(f"_extract_images——image_name: {image_name}")
                 image_key = os.path.splitext(image_name)[0]
-                logger.info(f"_extract_images——image_key: {image_key}")
                 self.images[image_key] = {
                     'content': image_content,
                     'name': image_name,
                     'media_type': item.media_type
                 }
-        logger.info(f"成功提取 {len(self.images)} 张图片")
+        logger.info(f"成功提取 {len(self.images)} 张图片，{len(self.documents)} 个文档")
+
+    def _format_metadata(self, ending: str) -> str:
+        """拼接书名与图书信息，ending 为紧随其后的分隔内容"""
+        book_title = self.metadata.get('title', '未知书籍')
+        parts = [f"# {book_title}\n\n", "## 图书信息\n\n"]
+        parts.extend(f"- **{key.capitalize()}**: {value}\n" for key, value in self.metadata.items())
+        parts.append(ending)
+        return ''.join(parts)
 
     def _write_metadata_to_file(self, file_path: str) -> None:
         """将元数据写入文件"""
         try:
-            book_title = self.metadata.get('title', '未知书籍')
             with open(file_path, "w", encoding="utf-8") as f:
-                f.write(f"# {book_title}\n\n")
-                f.write("## 图书信息\n\n")
-                for key, value in self.metadata.items():
-                    f.write(f"- **{key.capitalize()}**: {value}\n")
-                f.write("\n## 目录\n\n")
+                f.write(self._format_metadata("\n## 目录\n\n"))
             logger.info(f"成功写入元数据到文件: {file_path}")
         except Exception as e:
             logger.error(f"写入元数据失败: {str(e)}")
@@ -213,41 +419,30 @@ class EpubToMDConverter:
     def _save_images(self,output_dir:str) -> Dict[str,str]:
         """保存图片并返回路径映射"""
         image_paths = {}
-        for image_id, image_data in self.images.items():
+        full_assets_dir = self.file_utils.create_directory(output_dir, ConverterConfig.assets)
+        # self.images 以原始文件名（不含扩展名）为键，直接沿用为路径映射的键，与<img>的src对应
+        for image_key, image_data in self.images.items():
             try:
                 safe_name = self.file_utils.clean_filename(image_data['name'])
                 if not safe_name:
-                    safe_name = f"image_{image_id}{self.image_processor.get_extension(image_data['media_type'])}"
-                full_assets_dir = self.file_utils.create_directory(output_dir, ConverterConfig.assets)
+                    safe_name = f"image_{image_key}{self.image_processor.get_extension(image_data['media_type'])}"
                 image_path = os.path.join(full_assets_dir, safe_name)
-                image_name = safe_name.split('/')[-1].split('.')[0]
-                image_key = os.path.splitext(image_name)[0]
-                logger.info(f"image_path-----》: {image_key}")
                 self.file_utils.write_file(image_path, image_data['content'])
-                logger.info(f"image_name1-----》: {image_key}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"保存图片 {image_key}: {image_path}")
                 image_paths[image_key] =f"./{ConverterConfig.assets}/{safe_name}" 
             except Exception as e:
                 logger.error(f"保存图片 {image_key} 失败: {str(e)}")
         return image_paths
 
-    def _convert_chapter_to_markdown(self, html_content: str, image_paths: Dict[str, str]) -> str:
+    def _convert_chapter_to_markdown(self, html_content: str, image_paths: Dict[str, str], add_alt: bool = True) -> str:
         """将章节HTML转换为Markdown"""
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
         # 处理图片路径
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            #image_id = src.split('/')[-1].split('.')[0]
-            image_key = os.path.splitext(os.path.basename(src))[0]
-            logger.info(f"image_name2-----》: {image_key}")
-            if image_key in image_paths:
-                img['src'] = image_paths[image_key]
-                if not img.get('alt'):
-                    img['alt'] = f"Image {image_key}"
-        
+        html_content = HtmlProcessor.rewrite_images(html_content, image_paths, add_alt)
+        markdown = self.html2text.handle(html_content)
+
         # 获取章节标题
-        title = HtmlProcessor.get_chapter_title(soup)
-        markdown = self.html2text.handle(str(soup))
+        title = HtmlProcessor.get_chapter_title(markdown)
         
         # 确保章节标题在开头
         if title and not markdown.startswith(f"# {title}"):
@@ -255,11 +450,15 @@ class EpubToMDConverter:
             
         return markdown
 
+    def _convert_documents(self, image_map: Dict[str, str], add_alt: bool = True):
+        """用进程池并行转换所有文档，按原顺序逐章返回 (Markdown, 错误信息)"""
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker, initargs=(image_map, add_alt)) as executor:
+            yield from tqdm(executor.map(_convert_chapter, self.documents, chunksize=4), total=len(self.documents))
+
     def save_as_markdown(self, output_path: str) -> None:
         """保存为多个Markdown文件"""
         try:
-            self._extract_metadata()
-            self._extract_images()
+            self._load_items()
             
             # 创建输出目录
             output_dir = output_path
@@ -273,27 +472,31 @@ class EpubToMDConverter:
             readme_path = os.path.join(output_dir, "README.md")
             self._write_metadata_to_file(readme_path)
             
-            # 处理章节
+            # 处理章节，目录项先收集在内存中
+            toc_lines = []
             chapter_index = 1
-            for item in tqdm(self.book.get_items()):
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    try:
-                        content = item.get_content().decode('utf-8')
-                        markdown = self._convert_chapter_to_markdown(content, image_paths)
-                        chapter_filename = f"chapter_{chapter_index:03d}.md"
-                        chapter_path = os.path.join(output_dir, chapter_filename)
-                        
-                        # 保存章节文件
-                        self.file_utils.write_file(chapter_path, markdown.encode('utf-8'))
-                        
-                        # 更新目录
-                        title = markdown.split('\n', 1)[0].lstrip('#').strip() or f"Chapter {chapter_index}"
-                        with open(readme_path, "a", encoding="utf-8") as f:
-                            f.write(f"- [{title}]({chapter_filename})\n")
-                        
-                        chapter_index += 1
-                    except Exception as e:
-                        logger.error(f"处理章节 {chapter_index} 失败: {str(e)}")
+            for markdown, error in self._convert_documents(image_paths):
+                if error:
+                    logger.error(f"处理章节 {chapter_index} 失败: {error}")
+                    continue
+                try:
+                    chapter_filename = f"chapter_{chapter_index:03d}.md"
+                    chapter_path = os.path.join(output_dir, chapter_filename)
+                    
+                    # 保存章节文件
+                    self.file_utils.write_file(chapter_path, markdown.encode('utf-8'))
+                    
+                    # 记录目录项
+                    title = markdown.split('\n', 1)[0].lstrip('#').strip() or f"Chapter {chapter_index}"
+                    toc_lines.append(f"- [{title}]({chapter_filename})\n")
+                    
+                    chapter_index += 1
+                except Exception as e:
+                    logger.error(f"处理章节 {chapter_index} 失败: {str(e)}")
+
+            # 更新目录：全部章节转换后一次写入
+            with open(readme_path, "a", encoding="utf-8") as f:
+                f.writelines(toc_lines)
             
             logger.info(f"成功转换 {chapter_index-1} 个章节")
         except Exception as e:
@@ -303,8 +506,7 @@ class EpubToMDConverter:
     def save_as_single_markdown(self, output_path: str) -> None:
         """保存为单个Markdown文件"""
         try:
-            self._extract_metadata()
-            self._extract_images()
+            self._load_items()
             
             # 创建输出目录
             output_dir = os.path.dirname(output_path) or '.'
@@ -314,28 +516,29 @@ class EpubToMDConverter:
         #    assets_dir = self.file_utils.create_directory(output_dir, 'assets')
             image_paths = self._save_images(output_dir)
             
-            # 写入内容
-            with open(output_path, "w", encoding="utf-8") as f:
+            # 写入内容：编码后的字节先累积在缓冲区，超过 chunk_size 时整块写出
+            with open(output_path, "wb") as f:
                 # 写入元数据
-                book_title = self.metadata.get('title', '未知书籍')
-                f.write(f"# {book_title}\n\n")
-                f.write("## 图书信息\n\n")
-                for key, value in self.metadata.items():
-                    f.write(f"- **{key.capitalize()}**: {value}\n")
-                f.write("\n---\n\n")
+                buf = bytearray(self._format_metadata("\n---\n\n").encode('utf-8'))
                 
                 # 写入章节内容
                 chapter_count = 0
-                for item in tqdm(self.book.get_items()):
-                    if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                        try:
-                            content = item.get_content().decode('utf-8')
-                            markdown = self._convert_chapter_to_markdown(content, image_paths)
-                            f.write(f"\n{markdown}\n")
-                            f.write("\n---\n\n")
-                            chapter_count += 1
-                        except Exception as e:
-                            logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
+                for markdown, error in self._convert_documents(image_paths):
+                    if error:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {error}")
+                        continue
+                    try:
+                        data = markdown.encode('utf-8')
+                        buf += b"\n"
+                        buf += data
+                        buf += b"\n\n---\n\n"
+                        chapter_count += 1
+                    except Exception as e:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
+                    if len(buf) > ConverterConfig.chunk_size:
+                        f.write(buf)
+                        buf.clear()
+                f.write(buf)
                 
                 logger.info(f"成功转换 {chapter_count} 个章节")
         except Exception as e:
@@ -345,48 +548,37 @@ class EpubToMDConverter:
     def save_as_single_file_markdown(self, output_path: str) -> None:
         """保存为带Base64图片的单个Markdown文件"""
         try:
-            self._extract_metadata()
-            self._extract_images()
+            self._load_items()
             
-            # 转换图片为base64
-            image_data = {
-                image_id: self.image_processor.encode_to_base64(
-                    image['content'], 
-                    image['media_type']
-                ) for image_id, image in self.images.items()
-            }
+            # 图片引用先替换为按序号编号的占位引用，base64数据在写出时才逐块生成
+            images = list(self.images.values())
+            image_refs = {image_key: f"{EMBED_REF_PREFIX}{index}" for index, image_key in enumerate(self.images)}
             
             # 写入内容
-            with open(output_path, "w", encoding="utf-8") as f:
+            with open(output_path, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
                 # 写入元数据
-                book_title = self.metadata.get('title', '未知书籍')
-                f.write(f"# {book_title}\n\n")
-                f.write("## 图书信息\n\n")
-                for key, value in self.metadata.items():
-                    f.write(f"- **{key.capitalize()}**: {value}\n")
-                f.write("\n---\n\n")
+                f.write(self._format_metadata("\n---\n\n"))
                 
                 # 写入章节内容
                 chapter_count = 0
-                for item in tqdm(self.book.get_items()):
-                    if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                        try:
-                            content = item.get_content().decode('utf-8')
-                            soup = BeautifulSoup(content, 'html.parser')
-                            
-                            # 替换图片为base64
-                            for img in soup.find_all('img'):
-                                src = img.get('src', '')
-                                image_key = os.path.splitext(os.path.basename(src))[0]
-                                if image_key in image_data:
-                                    img['src'] = image_data[image_key]
-                            
-                            markdown = self._convert_chapter_to_markdown(str(soup), {})
-                            f.write(f"\n{markdown}\n")
-                            f.write("\n---\n\n")
-                            chapter_count += 1
-                        except Exception as e:
-                            logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
+                # 替换图片为base64，嵌入模式不补充alt文本
+                for markdown, error in self._convert_documents(image_refs, add_alt=False):
+                    if error:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {error}")
+                        continue
+                    try:
+                        f.write("\n")
+                        # split 结果中奇数位置为占位引用的图片序号
+                        for index, part in enumerate(EMBED_REF_RE.split(markdown)):
+                            if index % 2:
+                                image = images[int(part)]
+                                self.image_processor.write_base64_to(f, image['content'], image['media_type'])
+                            else:
+                                f.write(part)
+                        f.write("\n\n---\n\n")
+                        chapter_count += 1
+                    except Exception as e:
+                        logger.error(f"处理章节 {chapter_count + 1} 失败: {str(e)}")
                 
                 logger.info(f"成功转换 {chapter_count} 个章节")
         except Exception as e: